@@ -12,9 +12,29 @@ def _add_common_args(arg_parser):
     arg_parser.add_argument('--max_span_size', type=int, default=10, help="Maximum size of spans")
     arg_parser.add_argument('--lowercase', action='store_true', default=False,
                             help="If true, input is lowercased during preprocessing")
+    arg_parser.add_argument('--fast_tokenizer', action='store_true', default=False,
+                            help="If true, use a fast tokenizer (batched tokenization of datasets)")
+    arg_parser.add_argument('--parse_processes', type=int, default=0,
+                            help="Number of processes used to parse (decode and tokenize) datasets. "
+                                 "0 = no multiprocessing for parsing")
     arg_parser.add_argument('--sampling_processes', type=int, default=4,
                             help="Number of sampling processes. 0 = no multiprocessing for sampling")
     arg_parser.add_argument('--sampling_limit', type=int, default=100, help="Maximum number of sample batches in queue")
+    arg_parser.add_argument('--train_cache_size', type=int, default=10000,
+                            help="Maximum number of training documents whose sampling data is cached in memory "
+                                 "(in total over sampling processes). 0 = no caching")
+    arg_parser.add_argument('--eval_cache_size', type=int, default=10000,
+                            help="Maximum number of evaluation samples cached in memory (in total over sampling "
+                                 "processes). 0 = no in-memory caching")
+    arg_parser.add_argument('--eval_cache_path', type=str, default=None,
+                            help="Path to directory where evaluation samples are cached on disc")
+    arg_parser.add_argument('--dataset_cache_path', type=str, default=None,
+                            help="Path to directory where parsed datasets are cached (keyed by dataset, types and "
+                                 "tokenizer) and memory-mapped by later runs")
+    arg_parser.add_argument('--binary_datasets', action='store_true', default=False,
+                            help="If true, datasets are converted once to a binary format (stored next to the "
+                                 "JSON files, one conversion per dataset, types and tokenizer) and memory-mapped, "
+                                 "i.e. shared by sampling processes")
 
     # Logging
     arg_parser.add_argument('--label', type=str, help="Label of run. Used as the directory name of logs/models")
@@ -35,6 +55,21 @@ def _add_common_args(arg_parser):
     arg_parser.add_argument('--eval_batch_size', type=int, default=1, help="Evaluation batch size")
     arg_parser.add_argument('--max_pairs', type=int, default=1000,
                             help="Maximum entity pairs to process during training/evaluation")
+    arg_parser.add_argument('--window_size', type=int, default=None,
+                            help="Longer documents are encoded in overlapping windows of this size "
+                                 "(default: maximum position embeddings of the model)")
+    arg_parser.add_argument('--window_overlap', type=int, default=None,
+                            help="Overlap of neighboring encoding windows (default: a quarter of the window size)")
+    arg_parser.add_argument('--window_batch_size', type=int, default=8,
+                            help="Maximum number of windows (of long documents) encoded in one pass")
+    arg_parser.add_argument('--max_rel_entities', type=int, default=None,
+                            help="Maximum entities per document (top scored) paired as relation candidates "
+                                 "in evaluation (default: no limit)")
+    arg_parser.add_argument('--min_rel_entity_score', type=float, default=0.0,
+                            help="Minimum entity score to pair an entity as relation candidate in evaluation")
+    arg_parser.add_argument('--max_rel_distance', type=int, default=None,
+                            help="Maximum number of tokens between the entities of relation candidates "
+                                 "(default: 'max_rel_distance' of the type specifications, otherwise no limit)")
     arg_parser.add_argument('--rel_filter_threshold', type=float, default=0.4, help="Filter threshold for relations")
     arg_parser.add_argument('--size_embedding', type=int, default=25, help="Dimensionality of size embedding")
     arg_parser.add_argument('--prop_drop', type=float, default=0.1, help="Probability of dropout used in SpERT")
@@ -67,9 +102,31 @@ def train_argparser():
     arg_parser.add_argument('--train_log_iter', type=int, default=1, help="Log training process every x iterations")
     arg_parser.add_argument('--final_eval', action='store_true', default=False,
                             help="Evaluate the model only after training, not at every epoch")
+    arg_parser.add_argument('--stream_train', action='store_true', default=False,
+                            help="If true, training documents are parsed lazily while iterating (train_path must be "
+                                 "JSON lines, optionally compressed (gz/xz/bz2), or a glob pattern of such files)")
+    arg_parser.add_argument('--shuffle_buffer', type=int, default=10000,
+                            help="Size of the buffer used to shuffle streamed training documents")
+    arg_parser.add_argument('--shard_path', type=str, default=None,
+                            help="If set, training batches are sampled ahead into epoch shards in this directory "
+                                 "(by a background process or 'spert.py sample') and streamed during training")
+    arg_parser.add_argument('--shard_size', type=int, default=100, help="Number of batches per epoch shard")
+    arg_parser.add_argument('--rel_distance_percentile', type=float, default=None,
+                            help="If set, the maximum relation distance is this percentile of the number of "
+                                 "tokens between the entities of training relations (overrides max_rel_distance)")
+    arg_parser.add_argument('--span_size_percentile', type=float, default=None,
+                            help="If set, candidate spans of each entity type are limited to this percentile of the "
+                                 "sizes of training entities (the largest limit also caps max_span_size, limits are "
+                                 "stored in the types in the log path)")
+    arg_parser.add_argument('--derive_rel_signatures', action='store_true', default=False,
+                            help="If true, relation types are restricted to the (head, tail) entity types found in "
+                                 "training data (types with these signatures are stored in the log path)")
 
     # Model / Training
     arg_parser.add_argument('--train_batch_size', type=int, default=2, help="Training batch size")
+    arg_parser.add_argument('--train_batch_budget', type=int, default=None,
+                            help="If set, pack documents into training batches of variable size up to this budget "
+                                 "(batch size x context size x entity samples) instead of using train_batch_size")
     arg_parser.add_argument('--epochs', type=int, default=20, help="Number of epochs")
     arg_parser.add_argument('--neg_entity_count', type=int, default=100,
                             help="Number of negative entity samples per document (sentence)")
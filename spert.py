@@ -6,10 +6,14 @@ from spert import input_reader
 from spert.spert_trainer import SpERTTrainer
 
 
+def _input_reader_cls(run_args):
+    return input_reader.BinaryInputReader if run_args.binary_datasets else input_reader.JsonInputReader
+
+
 def __train(run_args):
     trainer = SpERTTrainer(run_args)
     trainer.train(train_path=run_args.train_path, valid_path=run_args.valid_path,
-                  types_path=run_args.types_path, input_reader_cls=input_reader.JsonInputReader)
+                  types_path=run_args.types_path, input_reader_cls=_input_reader_cls(run_args))
 
 
 def _train():
@@ -17,10 +21,21 @@ def _train():
     process_configs(target=__train, arg_parser=arg_parser)
 
 
+def __sample(run_args):
+    trainer = SpERTTrainer(run_args)
+    trainer.sample(train_path=run_args.train_path, types_path=run_args.types_path,
+                   input_reader_cls=_input_reader_cls(run_args))
+
+
+def _sample():
+    arg_parser = train_argparser()
+    process_configs(target=__sample, arg_parser=arg_parser)
+
+
 def __eval(run_args):
     trainer = SpERTTrainer(run_args)
     trainer.eval(dataset_path=run_args.dataset_path, types_path=run_args.types_path,
-                 input_reader_cls=input_reader.JsonInputReader)
+                 input_reader_cls=_input_reader_cls(run_args))
 
 
 def _eval():
@@ -30,12 +45,14 @@ def _eval():
 
 if __name__ == '__main__':
     arg_parser = argparse.ArgumentParser(add_help=False)
-    arg_parser.add_argument('mode', type=str, help="Mode: 'train' or 'eval'")
+    arg_parser.add_argument('mode', type=str, help="Mode: 'train', 'eval' or 'sample'")
     args, _ = arg_parser.parse_known_args()
 
     if args.mode == 'train':
         _train()
     elif args.mode == 'eval':
         _eval()
+    elif args.mode == 'sample':
+        _sample()
     else:
-        raise Exception("Mode not in ['train', 'eval'], e.g. 'python spert.py train ...'")
+        raise Exception("Mode not in ['train', 'eval', 'sample'], e.g. 'python spert.py train ...'")
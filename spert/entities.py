@@ -1,17 +1,25 @@
+import json
+import os
+import random
 from collections import OrderedDict
 from typing import List
-from torch.utils.data import Dataset as TorchDataset
+
+import numpy as np
+from torch.utils.data import Dataset as TorchDataset, IterableDataset, get_worker_info
 
 from spert import sampling
 
 
 class RelationType:
-    def __init__(self, identifier, index, short_name, verbose_name, symmetric=False):
+    __slots__ = ('_identifier', '_index', '_short_name', '_verbose_name', '_symmetric', '_signatures')
+
+    def __init__(self, identifier, index, short_name, verbose_name, symmetric=False, signatures=None):
         self._identifier = identifier
         self._index = index
         self._short_name = short_name
         self._verbose_name = verbose_name
         self._symmetric = symmetric
+        self._signatures = signatures  # possible (head, tail) entity types, None = any
 
     @property
     def identifier(self):
@@ -33,6 +41,14 @@ class RelationType:
     def symmetric(self):
         return self._symmetric
 
+    @property
+    def signatures(self):
+        return self._signatures
+
+    @signatures.setter
+    def signatures(self, value):
+        self._signatures = value
+
     def __int__(self):
         return self._index
 
@@ -46,11 +62,14 @@ class RelationType:
 
 
 class EntityType:
-    def __init__(self, identifier, index, short_name, verbose_name):
+    __slots__ = ('_identifier', '_index', '_short_name', '_verbose_name', '_max_span_size')
+
+    def __init__(self, identifier, index, short_name, verbose_name, max_span_size=None):
         self._identifier = identifier
         self._index = index
         self._short_name = short_name
         self._verbose_name = verbose_name
+        self._max_span_size = max_span_size  # maximum size of entities of this type, None = any
 
     @property
     def identifier(self):
@@ -68,6 +87,14 @@ class EntityType:
     def verbose_name(self):
         return self._verbose_name
 
+    @property
+    def max_span_size(self):
+        return self._max_span_size
+
+    @max_span_size.setter
+    def max_span_size(self, value):
+        self._max_span_size = value
+
     def __int__(self):
         return self._index
 
@@ -81,6 +108,8 @@ class EntityType:
 
 
 class Token:
+    __slots__ = ('_tid', '_index', '_span_start', '_span_end', '_phrase')
+
     def __init__(self, tid: int, index: int, span_start: int, span_end: int, phrase: str):
         self._tid = tid  # ID within the corresponding dataset
         self._index = index  # original token index in document
@@ -125,16 +154,21 @@ class Token:
 
 
 class TokenSpan:
-    def __init__(self, tokens):
+    """ View of the tokens [start, end) of a (document's) token list, slices are views as well """
+    __slots__ = ('_tokens', '_start', '_end')
+
+    def __init__(self, tokens, start: int = 0, end: int = None):
         self._tokens = tokens
+        self._start = start
+        self._end = end if end is not None else len(tokens)
 
     @property
     def span_start(self):
-        return self._tokens[0].span_start
+        return self._tokens[self._start].span_start
 
     @property
     def span_end(self):
-        return self._tokens[-1].span_end
+        return self._tokens[self._end - 1].span_end
 
     @property
     def span(self):
@@ -142,24 +176,36 @@ class TokenSpan:
 
     def __getitem__(self, s):
         if isinstance(s, slice):
-            return TokenSpan(self._tokens[s.start:s.stop:s.step])
+            start, stop, step = s.indices(len(self))
+            if step == 1:
+                return TokenSpan(self._tokens, self._start + start, self._start + max(start, stop))
+
+            return TokenSpan([self[i] for i in range(start, stop, step)])
         else:
-            return self._tokens[s]
+            if s < 0:
+                s += len(self)
+            if not 0 <= s < len(self):
+                raise IndexError('token index out of range')
+
+            return self._tokens[self._start + s]
 
     def __iter__(self):
-        return iter(self._tokens)
+        return (self._tokens[i] for i in range(self._start, self._end))
 
     def __len__(self):
-        return len(self._tokens)
+        return self._end - self._start
 
 
 class Entity:
+    __slots__ = ('_eid', '_entity_type', '_tokens', '_phrase')
+
     def __init__(self, eid: int, entity_type: EntityType, tokens: List[Token], phrase: str):
         self._eid = eid  # ID within the corresponding dataset
 
         self._entity_type = entity_type
 
-        self._tokens = tokens
+        # view of the document's tokens (no copy)
+        self._tokens = tokens if isinstance(tokens, TokenSpan) else TokenSpan(tokens)
         self._phrase = phrase
 
     def as_tuple(self):
@@ -171,19 +217,19 @@ class Entity:
 
     @property
     def tokens(self):
-        return TokenSpan(self._tokens)
+        return self._tokens
 
     @property
     def span_start(self):
-        return self._tokens[0].span_start
+        return self._tokens.span_start
 
     @property
     def span_end(self):
-        return self._tokens[-1].span_end
+        return self._tokens.span_end
 
     @property
     def span(self):
-        return self.span_start, self.span_end
+        return self._tokens.span
 
     @property
     def phrase(self):
@@ -202,6 +248,8 @@ class Entity:
 
 
 class Relation:
+    __slots__ = ('_rid', '_relation_type', '_head_entity', '_tail_entity', '_reverse')
+
     def __init__(self, rid: int, relation_type: RelationType, head_entity: Entity,
                  tail_entity: Entity, reverse: bool = False):
         self._rid = rid  # ID within the corresponding dataset
@@ -212,9 +260,6 @@ class Relation:
 
         self._reverse = reverse
 
-        self._first_entity = head_entity if not reverse else tail_entity
-        self._second_entity = tail_entity if not reverse else head_entity
-
     def as_tuple(self):
         head = self._head_entity
         tail = self._tail_entity
@@ -239,11 +284,11 @@ class Relation:
 
     @property
     def first_entity(self):
-        return self._first_entity
+        return self._head_entity if not self._reverse else self._tail_entity
 
     @property
     def second_entity(self):
-        return self._second_entity
+        return self._tail_entity if not self._reverse else self._head_entity
 
     @property
     def reverse(self):
@@ -259,11 +304,13 @@ class Relation:
 
 
 class Document:
+    __slots__ = ('_doc_id', '_tokens', '_entities', '_relations', '_encoding')
+
     def __init__(self, doc_id: int, tokens: List[Token], entities: List[Entity], relations: List[Relation],
                  encoding: List[int]):
         self._doc_id = doc_id  # ID within the corresponding dataset
 
-        self._tokens = tokens
+        self._tokens = tokens if isinstance(tokens, TokenSpan) else TokenSpan(tokens)
         self._entities = entities
         self._relations = relations
 
@@ -284,7 +331,7 @@ class Document:
 
     @property
     def tokens(self):
-        return TokenSpan(self._tokens)
+        return self._tokens
 
     @property
     def encoding(self):
@@ -344,9 +391,17 @@ class Dataset(TorchDataset):
         self._max_span_size = max_span_size
         self._mode = Dataset.TRAIN_MODE
 
-        self._documents = OrderedDict()
-        self._entities = OrderedDict()
-        self._relations = OrderedDict()
+        # indexed by ID (IDs are assigned consecutively)
+        self._documents = []
+        self._entities = []
+        self._relations = []
+
+        # static sampling data of documents (reused across epochs), least recently used documents are dropped
+        self._train_candidates = OrderedDict()
+        self._train_cache_size = 10000
+        self._rel_signatures = None
+        self._max_rel_distance = None
+        self._eval_cache = None
 
         # current ids
         self._doc_id = 0
@@ -360,6 +415,10 @@ class Dataset(TorchDataset):
     def iterate_relations(self, batch_size, order=None, truncate=False):
         return BatchIterator(self.relations, batch_size, order=order, truncate=truncate)
 
+    def document_stream(self):
+        # documents one at a time (mapped datasets do not create all documents at once)
+        return (self.get_document(i) for i in range(self.document_count))
+
     def create_token(self, idx, span_start, span_end, phrase) -> Token:
         token = Token(self._tid, idx, span_start, span_end, phrase)
         self._tid += 1
@@ -367,38 +426,99 @@ class Dataset(TorchDataset):
 
     def create_document(self, tokens, entity_mentions, relations, doc_encoding) -> Document:
         document = Document(self._doc_id, tokens, entity_mentions, relations, doc_encoding)
-        self._documents[self._doc_id] = document
+        self._documents.append(document)
         self._doc_id += 1
 
         return document
 
     def create_entity(self, entity_type, tokens, phrase) -> Entity:
         mention = Entity(self._eid, entity_type, tokens, phrase)
-        self._entities[self._eid] = mention
+        self._entities.append(mention)
         self._eid += 1
         return mention
 
     def create_relation(self, relation_type, head_entity, tail_entity, reverse=False) -> Relation:
         relation = Relation(self._rid, relation_type, head_entity, tail_entity, reverse)
-        self._relations[self._rid] = relation
+        self._relations.append(relation)
         self._rid += 1
         return relation
 
     def __len__(self):
         return len(self._documents)
 
+    def get_document(self, index: int) -> Document:
+        return self._documents[index]
+
     def __getitem__(self, index: int):
-        doc = self._documents[index]
+        doc = self.get_document(index)
 
         if self._mode == Dataset.TRAIN_MODE:
             return sampling.create_train_sample(doc, self._neg_entity_count, self._neg_rel_count,
-                                                self._max_span_size, len(self._rel_types))
+                                                self._max_span_size, len(self._rel_types),
+                                                candidates=self._get_train_candidates(index, doc))
+        elif self._eval_cache is not None:
+            return self._eval_cache.get(doc)
         else:
             return sampling.create_eval_sample(doc, self._max_span_size)
 
     def switch_mode(self, mode):
         self._mode = mode
 
+    def set_max_span_size(self, max_span_size: int):
+        # candidate spans (negative entities in training, all spans in evaluation) of at most this size
+        self._max_span_size = max_span_size
+        self._train_candidates = OrderedDict()
+
+        if self._eval_cache is not None:
+            self._eval_cache.set_max_span_size(max_span_size)
+
+    def set_max_rel_distance(self, distance: int):
+        # negative relations are only sampled between entities with at most 'distance' tokens in between
+        self._max_rel_distance = distance
+        self._train_candidates = OrderedDict()
+
+    def set_train_cache_size(self, size: int, processes: int = 0):
+        # maximum number of documents whose sampling data is cached (0 = no caching)
+        # each sampling process has its own cache, so 'size' is split among them
+        if processes > 0:
+            size = -(-size // processes)
+
+        self._train_cache_size = size
+        self._train_candidates = OrderedDict()
+
+    def _get_train_candidates(self, index, doc):
+        if index in self._train_candidates:
+            self._train_candidates.move_to_end(index)
+            return self._train_candidates[index]
+
+        candidates = sampling.create_train_candidates(doc, self._max_span_size, self._pair_signatures(),
+                                                      self._max_rel_distance)
+
+        if self._train_cache_size > 0:
+            self._train_candidates[index] = candidates
+
+            if len(self._train_candidates) > self._train_cache_size:
+                self._train_candidates.popitem(last=False)
+
+        return candidates
+
+    def _pair_signatures(self):
+        # entity type pairs that can be related by any relation type (negative relations of other pairs are
+        # not sampled), None if relations are not constrained
+        if self._rel_signatures is None:
+            signatures = relation_signatures(self._rel_types, self._entity_types)
+            self._rel_signatures = signatures.any(-1) if signatures is not None else False
+
+        return self._rel_signatures if self._rel_signatures is not False else None
+
+    def enable_eval_cache(self, size: int, path: str = None, processes: int = 0):
+        # memoize evaluation samples (in memory, optionally on disc) for repeated evaluation
+        # each sampling process caches the samples of the batches pinned to it, so 'size' is split among them
+        if processes > 0:
+            size = -(-size // processes)
+
+        self._eval_cache = sampling.EvalSampleCache(self._max_span_size, size, path)
+
     @property
     def label(self):
         return self._label
@@ -409,15 +529,27 @@ class Dataset(TorchDataset):
 
     @property
     def documents(self):
-        return list(self._documents.values())
+        return self._documents
+
+    @property
+    def doc_token_counts(self):
+        return np.array([len(doc.tokens) for doc in self._documents], dtype=np.int64)
+
+    @property
+    def doc_encoding_sizes(self):
+        return np.array([len(doc.encoding) for doc in self._documents], dtype=np.int64)
+
+    @property
+    def doc_entity_counts(self):
+        return np.array([len(doc.entities) for doc in self._documents], dtype=np.int64)
 
     @property
     def entities(self):
-        return list(self._entities.values())
+        return self._entities
 
     @property
     def relations(self):
-        return list(self._relations.values())
+        return self._relations
 
     @property
     def document_count(self):
@@ -430,3 +562,315 @@ class Dataset(TorchDataset):
     @property
     def relation_count(self):
         return len(self._relations)
+
+    @property
+    def max_encoding_size(self):
+        return max(len(doc.encoding) for doc in self._documents)
+
+
+class MappedDataset(Dataset):
+    """ Dataset that memory-maps a columnar binary layout (shared between processes), see 'MappedDataset.write' """
+    META_FILE = 'meta.json'
+    ARRAYS = ['doc_tokens', 'token_spans', 'token_indices', 'phrase_offsets', 'phrases',
+              'doc_encodings', 'encodings', 'doc_entities', 'entities', 'doc_relations', 'relations']
+
+    def __init__(self, label, rel_types, entity_types, neg_entity_count,
+                 neg_rel_count, max_span_size, path):
+        super().__init__(label, rel_types, entity_types, neg_entity_count, neg_rel_count, max_span_size)
+        meta = json.load(open(os.path.join(path, MappedDataset.META_FILE)))
+
+        if meta['entity_types'] != list(entity_types.keys()) or meta['relation_types'] != list(rel_types.keys()):
+            raise Exception("Types of binary dataset '%s' do not match type specifications" % path)
+
+        self._path = path
+        self._idx2entity_type = list(entity_types.values())
+        self._idx2rel_type = list(rel_types.values())
+
+        # per-document offsets (length: document count + 1) into flat arrays
+        self._arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+                        for name in MappedDataset.ARRAYS}
+
+    @staticmethod
+    def write(dataset: Dataset, path: str, key: str = None):
+        # flat arrays of all documents with per-document offsets
+        columns = {name: [] for name in MappedDataset.ARRAYS}
+        offsets = dict(doc_tokens=[0], doc_encodings=[0], doc_entities=[0], doc_relations=[0])
+        phrase_offsets = [0]
+
+        for doc in dataset.documents:
+            tokens = list(doc.tokens)
+            entity_indices = {entity: i for i, entity in enumerate(doc.entities)}
+            token_positions = {token: i for i, token in enumerate(tokens)}
+
+            for token in tokens:
+                phrase = token.phrase.encode('utf-8')
+                columns['token_spans'].append(token.span)
+                columns['token_indices'].append(token.index)
+                columns['phrases'].append(phrase)
+                phrase_offsets.append(phrase_offsets[-1] + len(phrase))
+
+            for entity in doc.entities:
+                entity_tokens = list(entity.tokens)
+                columns['entities'].append((token_positions[entity_tokens[0]], token_positions[entity_tokens[-1]] + 1,
+                                            entity.entity_type.index))
+
+            for relation in doc.relations:
+                columns['relations'].append((entity_indices[relation.head_entity],
+                                             entity_indices[relation.tail_entity],
+                                             relation.relation_type.index, int(relation.reverse)))
+
+            columns['encodings'].extend(doc.encoding)
+
+            offsets['doc_tokens'].append(offsets['doc_tokens'][-1] + len(tokens))
+            offsets['doc_encodings'].append(offsets['doc_encodings'][-1] + len(doc.encoding))
+            offsets['doc_entities'].append(offsets['doc_entities'][-1] + len(doc.entities))
+            offsets['doc_relations'].append(offsets['doc_relations'][-1] + len(doc.relations))
+
+        arrays = {name: np.array(values, dtype=np.int64) for name, values in offsets.items()}
+        arrays['phrase_offsets'] = np.array(phrase_offsets, dtype=np.int64)
+        arrays['phrases'] = np.frombuffer(b''.join(columns['phrases']), dtype=np.uint8)
+        arrays['token_spans'] = np.array(columns['token_spans'], dtype=np.int32).reshape(-1, 2)
+        arrays['token_indices'] = np.array(columns['token_indices'], dtype=np.int32)
+        arrays['encodings'] = np.array(columns['encodings'], dtype=np.int32)
+        arrays['entities'] = np.array(columns['entities'], dtype=np.int32).reshape(-1, 3)
+        arrays['relations'] = np.array(columns['relations'], dtype=np.int32).reshape(-1, 4)
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        for name, array in arrays.items():
+            np.save(os.path.join(path, name + '.npy'), array)
+
+        # meta data is written last (marks a complete conversion)
+        meta = dict(entity_types=list(dataset._entity_types.keys()),
+                    relation_types=list(dataset._rel_types.keys()), key=key)
+        json.dump(meta, open(os.path.join(path, MappedDataset.META_FILE), 'w'))
+
+    def get_document(self, index: int) -> Document:
+        # documents are created on access (from shared pages) and not kept in memory
+        a = self._arrays
+        token_start, token_end = a['doc_tokens'][index], a['doc_tokens'][index + 1]
+        entity_start, entity_end = a['doc_entities'][index], a['doc_entities'][index + 1]
+        rel_start, rel_end = a['doc_relations'][index], a['doc_relations'][index + 1]
+
+        # ids are derived from flat array positions (stable across processes)
+        phrase_offsets = a['phrase_offsets'][token_start:token_end + 1]
+        phrases = a['phrases'][phrase_offsets[0]:phrase_offsets[-1]].tobytes()
+        tokens = []
+        for i, ((span_start, span_end), idx) in enumerate(zip(a['token_spans'][token_start:token_end].tolist(),
+                                                              a['token_indices'][token_start:token_end].tolist())):
+            phrase = phrases[phrase_offsets[i] - phrase_offsets[0]:phrase_offsets[i + 1] - phrase_offsets[0]]
+            tokens.append(Token(int(token_start) + i, idx, span_start, span_end, phrase.decode('utf-8')))
+
+        entities = []
+        for i, (start, end, type_idx) in enumerate(a['entities'][entity_start:entity_end].tolist()):
+            entity_tokens = TokenSpan(tokens, start, end)
+            phrase = " ".join([t.phrase for t in entity_tokens])
+            entities.append(Entity(int(entity_start) + i, self._idx2entity_type[type_idx], entity_tokens, phrase))
+
+        relations = []
+        for i, (head, tail, type_idx, reverse) in enumerate(a['relations'][rel_start:rel_end].tolist()):
+            relations.append(Relation(int(rel_start) + i, self._idx2rel_type[type_idx], entities[head],
+                                      entities[tail], bool(reverse)))
+
+        encoding = a['encodings'][a['doc_encodings'][index]:a['doc_encodings'][index + 1]].tolist()
+
+        return Document(index, tokens, entities, relations, encoding)
+
+    def __len__(self):
+        return self.document_count
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def documents(self):
+        return [self.get_document(i) for i in range(self.document_count)]
+
+    @property
+    def doc_token_counts(self):
+        # per-document counts from offsets (without creating documents)
+        return np.diff(self._arrays['doc_tokens'])
+
+    @property
+    def doc_encoding_sizes(self):
+        return np.diff(self._arrays['doc_encodings'])
+
+    @property
+    def doc_entity_counts(self):
+        return np.diff(self._arrays['doc_entities'])
+
+    @property
+    def entities(self):
+        return [entity for doc in self.documents for entity in doc.entities]
+
+    @property
+    def relations(self):
+        return [relation for doc in self.documents for relation in doc.relations]
+
+    @property
+    def document_count(self):
+        return len(self._arrays['doc_tokens']) - 1
+
+    @property
+    def entity_count(self):
+        return len(self._arrays['entities'])
+
+    @property
+    def relation_count(self):
+        return len(self._arrays['relations'])
+
+    @property
+    def max_encoding_size(self):
+        return int(np.diff(self._arrays['doc_encodings']).max())
+
+
+class StreamingDataset(Dataset, IterableDataset):
+    """ Dataset that parses documents lazily while iterating (no random access), see 'StreamingInputReader' """
+
+    def __init__(self, label, rel_types, entity_types, neg_entity_count, neg_rel_count, max_span_size,
+                 read_lines, parse_document, index: dict, shuffle_buffer: int = 0):
+        super().__init__(label, rel_types, entity_types, neg_entity_count, neg_rel_count, max_span_size)
+        self._read_lines = read_lines  # (random.Random) -> iterable of JSON lines (one document per line)
+        self._parse_document = parse_document  # (JSON document, dataset) -> Document
+        self._index = index
+        self._shuffle_buffer = shuffle_buffer
+        self._seed = 0
+
+    def set_seed(self, seed: int):
+        # seed of file order and shuffle buffer (set before each epoch, shared by data loader workers)
+        self._seed = seed
+
+    def batch_count(self, batch_size: int, worker_count: int) -> int:
+        # each data loader worker drops its own incomplete last batch
+        worker_count = max(worker_count, 1)
+        n = self.document_count
+        return sum((n // worker_count + (w < n % worker_count)) // batch_size for w in range(worker_count))
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        worker_id, worker_count = (worker_info.id, worker_info.num_workers) if worker_info is not None else (0, 1)
+
+        # lines are distributed over workers before decoding and parsing
+        lines = (line for i, line in enumerate(self._read_lines(random.Random(self._seed)))
+                 if i % worker_count == worker_id)
+        jdocs = (json.loads(line) for line in lines)
+        documents = (self._parse_document(jdoc, self) for jdoc in jdocs)
+
+        if self._shuffle_buffer > 1:
+            documents = _shuffle(documents, self._shuffle_buffer, random.Random(self._seed + worker_id + 1))
+
+        for doc in documents:
+            if self._mode == Dataset.TRAIN_MODE:
+                yield sampling.create_train_sample(doc, self._neg_entity_count, self._neg_rel_count,
+                                                   self._max_span_size, len(self._rel_types),
+                                                   rel_signatures=self._pair_signatures(),
+                                                   max_rel_distance=self._max_rel_distance)
+            else:
+                yield sampling.create_eval_sample(doc, self._max_span_size)
+
+    def create_document(self, tokens, entity_mentions, relations, doc_encoding) -> Document:
+        # parsed documents are not kept in memory
+        document = Document(self._doc_id, tokens, entity_mentions, relations, doc_encoding)
+        self._doc_id += 1
+        return document
+
+    def create_entity(self, entity_type, tokens, phrase) -> Entity:
+        mention = Entity(self._eid, entity_type, tokens, phrase)
+        self._eid += 1
+        return mention
+
+    def create_relation(self, relation_type, head_entity, tail_entity, reverse=False) -> Relation:
+        relation = Relation(self._rid, relation_type, head_entity, tail_entity, reverse)
+        self._rid += 1
+        return relation
+
+    def _random_access_error(self):
+        return Exception("Streaming dataset '%s' does not support random access" % self._label)
+
+    def get_document(self, index: int) -> Document:
+        raise self._random_access_error()
+
+    def __getitem__(self, index: int):
+        raise self._random_access_error()
+
+    def __len__(self):
+        return self.document_count
+
+    @property
+    def documents(self):
+        raise self._random_access_error()
+
+    @property
+    def doc_token_counts(self):
+        raise self._random_access_error()
+
+    @property
+    def doc_encoding_sizes(self):
+        raise self._random_access_error()
+
+    @property
+    def doc_entity_counts(self):
+        raise self._random_access_error()
+
+    @property
+    def entities(self):
+        raise self._random_access_error()
+
+    @property
+    def relations(self):
+        raise self._random_access_error()
+
+    @property
+    def document_count(self):
+        return self._index['document_count']
+
+    @property
+    def entity_count(self):
+        return self._index['entity_count']
+
+    @property
+    def relation_count(self):
+        return self._index['relation_count']
+
+    @property
+    def max_encoding_size(self):
+        return self._index['context_size']
+
+
+def relation_signatures(rel_types, entity_types):
+    # mask of possible relations [head entity type, tail entity type, relation type (without 'None')],
+    # None if no relation type is constrained
+    rel_types = list(rel_types.values())[1:]
+    if all(rel_type.signatures is None for rel_type in rel_types):
+        return None
+
+    signatures = np.zeros([len(entity_types), len(entity_types), len(rel_types)], dtype=bool)
+    for i, rel_type in enumerate(rel_types):
+        if rel_type.signatures is None:
+            signatures[..., i] = True
+            continue
+
+        for head_type, tail_type in rel_type.signatures:
+            signatures[head_type.index, tail_type.index, i] = True
+
+            if rel_type.symmetric:
+                signatures[tail_type.index, head_type.index, i] = True
+
+    return signatures
+
+
+def _shuffle(items, buffer_size, rnd):
+    # approximate shuffling: yields a random item of a buffer that is refilled from the stream
+    buffer = []
+    for item in items:
+        if len(buffer) < buffer_size:
+            buffer.append(item)
+        else:
+            i = rnd.randrange(buffer_size)
+            yield buffer[i]
+            buffer[i] = item
+
+    rnd.shuffle(buffer)
+    yield from buffer
@@ -1,7 +1,7 @@
 import json
 import os
 import warnings
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Iterable
 
 import torch
 from sklearn.metrics import precision_recall_fscore_support as prfs
@@ -33,23 +33,33 @@ class Evaluator:
         self._examples_path = examples_path
         self._example_count = example_count
 
+        # predictions are stored by document index (batches may not follow the dataset's order)
+        doc_count = self._dataset.document_count
+        self._eval_count = 0
+
         # relations
         self._gt_relations = []  # ground truth
-        self._pred_relations = []  # prediction
+        self._pred_relations = [[] for _ in range(doc_count)]  # prediction
 
         # entities
         self._gt_entities = []  # ground truth
-        self._pred_entities = []  # prediction
+        self._pred_entities = [[] for _ in range(doc_count)]  # prediction
 
         self._pseudo_entity_type = EntityType('Entity', 1, 'Entity', 'Entity')  # for span only evaluation
 
-        self._convert_gt(self._dataset.documents)
+        self._convert_gt(self._dataset.document_stream())
 
     def eval_batch(self, batch_entity_clf: torch.tensor, batch_rel_clf: torch.tensor,
-                   batch_rels: torch.tensor, batch: dict):
+                   batch_rels: torch.tensor, batch: dict, doc_indices: List[int] = None):
         batch_size = batch_rel_clf.shape[0]
         rel_class_count = batch_rel_clf.shape[2]
 
+        if doc_indices is None:
+            # batches follow the dataset's order
+            doc_indices = list(range(self._eval_count, self._eval_count + batch_size))
+
+        self._eval_count += batch_size
+
         # get maximum activation (index of predicted entity type)
         batch_entity_types = batch_entity_clf.argmax(dim=-1)
         # apply entity sample mask
@@ -101,8 +111,8 @@ class Evaluator:
                 sample_pred_entities, sample_pred_relations = self._remove_overlapping(sample_pred_entities,
                                                                                        sample_pred_relations)
 
-            self._pred_entities.append(sample_pred_entities)
-            self._pred_relations.append(sample_pred_relations)
+            self._pred_entities[doc_indices[i]] = sample_pred_entities
+            self._pred_relations[doc_indices[i]] = sample_pred_relations
 
     def compute_scores(self):
         print("Evaluation")
@@ -137,7 +147,7 @@ class Evaluator:
     def store_predictions(self):
         predictions = []
 
-        for i, doc in enumerate(self._dataset.documents):
+        for i, doc in enumerate(self._dataset.document_stream()):
             tokens = doc.tokens
             pred_entities = self._pred_entities[i]
             pred_relations = self._pred_relations[i]
@@ -192,7 +202,7 @@ class Evaluator:
         rel_examples = []
         rel_examples_nec = []
 
-        for i, doc in enumerate(self._dataset.documents):
+        for i, doc in enumerate(self._dataset.document_stream()):
             # entities
             entity_example = self._convert_example(doc, self._gt_entities[i], self._pred_entities[i],
                                                    include_entity_types=True, to_html=self._entity_to_html)
@@ -242,7 +252,7 @@ class Evaluator:
                              file_path=self._examples_path % ('rel_nec_sorted', label, epoch),
                              template='relation_examples.html')
 
-    def _convert_gt(self, docs: List[Document]):
+    def _convert_gt(self, docs: Iterable[Document]):
         for doc in docs:
             gt_relations = doc.relations
             gt_entities = doc.entities
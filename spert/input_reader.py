@@ -1,19 +1,34 @@
+import bz2
+import collections
+import glob
+import gzip
+import hashlib
 import json
+import lzma
+import os
+import shutil
+import sys
 from abc import abstractmethod, ABC
 from collections import OrderedDict
 from logging import Logger
-from typing import Iterable, List
+from typing import Iterable
 
+import numpy as np
+import torch
+import torch.multiprocessing as mp
 from tqdm import tqdm
 from transformers import BertTokenizer
 
+from spert import sampling
 from spert import util
-from spert.entities import Dataset, EntityType, RelationType, Entity, Relation, Document
+from spert.entities import Dataset, EntityType, RelationType, Document, MappedDataset, TokenSpan, \
+    StreamingDataset, relation_signatures
 
 
 class BaseInputReader(ABC):
     def __init__(self, types_path: str, tokenizer: BertTokenizer, neg_entity_count: int = None,
-                 neg_rel_count: int = None, max_span_size: int = None, logger: Logger = None):
+                 neg_rel_count: int = None, max_span_size: int = None, logger: Logger = None,
+                 cache_path: str = None):
         types = json.load(open(types_path), object_pairs_hook=OrderedDict)  # entity + relation types
 
         self._entity_types = OrderedDict()
@@ -29,7 +44,7 @@ class BaseInputReader(ABC):
 
         # specified entity types
         for i, (key, v) in enumerate(types['entities'].items()):
-            entity_type = EntityType(key, i + 1, v['short'], v['verbose'])
+            entity_type = EntityType(key, i + 1, v['short'], v['verbose'], v.get('max_span_size'))
             self._entity_types[key] = entity_type
             self._idx2entity_type[i + 1] = entity_type
 
@@ -45,15 +60,32 @@ class BaseInputReader(ABC):
             self._relation_types[key] = relation_type
             self._idx2relation_type[i + 1] = relation_type
 
+        # optional relation signatures: possible (head, tail) entity types of relation types
+        # e.g. "signatures": {"Adverse-Effect": [["Drug", "Effect"]]}, relation types not listed are unconstrained
+        for key, signatures in types.get('signatures', dict()).items():
+            self._relation_types[key].signatures = [(self._entity_types[head], self._entity_types[tail])
+                                                    for head, tail in signatures]
+
+        # optional maximum number of tokens between the entities of relation candidates
+        self._max_rel_distance = types.get('max_rel_distance')
+
+        self._types = types
+
         self._neg_entity_count = neg_entity_count
         self._neg_rel_count = neg_rel_count
-        self._max_span_size = max_span_size
+
+        # candidate spans are not larger than the maximum size of (all) entity types
+        self._max_span_size = self._span_size_cap(max_span_size)
 
         self._datasets = dict()
 
         self._tokenizer = tokenizer
         self._logger = logger
 
+        # directory of parsed datasets (see 'dataset_key')
+        self._types_path = types_path
+        self._cache_path = cache_path
+
         self._vocabulary_size = tokenizer.vocab_size
         self._context_size = -1
 
@@ -72,16 +104,103 @@ class BaseInputReader(ABC):
         relation = self._idx2relation_type[idx]
         return relation
 
-    def _calc_context_size(self, datasets: Iterable[Dataset]):
-        sizes = []
+    def derive_relation_signatures(self, label):
+        """ Set the signatures of all relation types to the (head, tail) entity types found in a dataset """
+        signatures = OrderedDict((relation_type, OrderedDict()) for relation_type in self._relation_types.values())
+        relations = (relation for doc in self._datasets[label].document_stream() for relation in doc.relations)
+        for relation in relations:
+            head_type, tail_type = relation.head_entity.entity_type, relation.tail_entity.entity_type
+
+            if relation.relation_type.symmetric and (tail_type, head_type) in signatures[relation.relation_type]:
+                continue
+
+            signatures[relation.relation_type][(head_type, tail_type)] = None
+
+        for relation_type, type_pairs in signatures.items():
+            if relation_type.index != 0:
+                relation_type.signatures = list(type_pairs.keys())
+
+    def relation_distance(self, label, percentile: float):
+        """ Percentile of the number of tokens between the entities of relations in a dataset """
+        spans = [(relation.head_entity.span, relation.tail_entity.span)
+                 for doc in self._datasets[label].document_stream() for relation in doc.relations]
+        if not spans:
+            return None
+
+        spans = np.array(spans, dtype=np.int64).reshape(-1, 2, 2)
+        ctx_spans = sampling.create_rel_ctx_spans(spans[:, 0], spans[:, 1])
+        distances = np.maximum(ctx_spans[:, 1] - ctx_spans[:, 0], 0)
+
+        return int(np.ceil(np.percentile(distances, percentile)))
+
+    def derive_span_size_limits(self, label, percentile: float):
+        """ Set the maximum span size of all entity types to a percentile of the sizes of entities in a dataset """
+        sizes = OrderedDict((entity_type, []) for entity_type in self._entity_types.values())
+        for doc in self._datasets[label].document_stream():
+            for entity in doc.entities:
+                sizes[entity.entity_type].append(len(entity.tokens))
+
+        # types without entities are not constrained
+        for entity_type, type_sizes in sizes.items():
+            if entity_type.index != 0 and type_sizes:
+                entity_type.max_span_size = int(np.ceil(np.percentile(type_sizes, percentile)))
+
+        self._max_span_size = self._span_size_cap(self._max_span_size)
+        for dataset in self._datasets.values():
+            dataset.set_max_span_size(self._max_span_size)
+
+    def save_types(self, path):
+        # type specifications including relation signatures and entity span sizes (e.g. derived from training data)
+        types = OrderedDict(self._types)
+        types['entities'] = OrderedDict(self._types['entities'])
+        for key, entity_type in list(self._entity_types.items())[1:]:
+            if entity_type.max_span_size is not None:
+                types['entities'][key] = OrderedDict(types['entities'][key], max_span_size=entity_type.max_span_size)
+
+        signatures = OrderedDict((key, [[head.identifier, tail.identifier] for head, tail in relation_type.signatures])
+                                 for key, relation_type in list(self._relation_types.items())[1:]
+                                 if relation_type.signatures is not None)
+        if signatures:
+            types['signatures'] = signatures
+
+        if self._max_rel_distance is not None:
+            types['max_rel_distance'] = self._max_rel_distance
 
-        for dataset in datasets:
-            for doc in dataset.documents:
-                sizes.append(len(doc.encoding))
+        with open(path, 'w') as f:
+            json.dump(types, f)
 
-        context_size = max(sizes)
+    def set_max_rel_distance(self, distance: int):
+        self._max_rel_distance = distance
+
+    def _span_size_cap(self, max_span_size):
+        limits = [entity_type.max_span_size for entity_type in list(self._entity_types.values())[1:]]
+        if not limits or None in limits:
+            return max_span_size
+
+        return min(max_span_size, max(limits)) if max_span_size is not None else max(limits)
+
+    def _calc_context_size(self, datasets: Iterable[Dataset]):
+        context_size = max(dataset.max_encoding_size for dataset in datasets)
         return context_size
 
+    def dataset_key(self, dataset_path):
+        # parsed datasets depend on dataset files, types and tokenizer (vocabulary and lowercasing)
+        key = hashlib.sha1()
+
+        for path in _dataset_files(dataset_path) + [self._types_path]:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    key.update(chunk)
+
+        tokenizer = self._tokenizer
+        vocab = tokenizer.get_vocab() if hasattr(tokenizer, 'get_vocab') else tokenizer.vocab
+        lowercase = getattr(tokenizer, 'do_lower_case', None)
+        if lowercase is None and hasattr(tokenizer, 'basic_tokenizer'):
+            lowercase = tokenizer.basic_tokenizer.do_lower_case
+
+        key.update(json.dumps([type(tokenizer).__name__, lowercase, sorted(vocab.items())]).encode('utf-8'))
+        return key.hexdigest()
+
     def _log(self, text):
         if self._logger is not None:
             self._logger.info(text)
@@ -98,6 +217,31 @@ class BaseInputReader(ABC):
     def relation_types(self):
         return self._relation_types
 
+    @property
+    def relation_signatures(self):
+        # mask of possible relations [head entity type, tail entity type, relation type], None = unconstrained
+        signatures = relation_signatures(self._relation_types, self._entity_types)
+        return torch.from_numpy(signatures) if signatures is not None else None
+
+    @property
+    def entity_size_limits(self):
+        # maximum span size of entity types [entity type] ('None' type: no limit), None = unconstrained
+        entity_types = list(self._entity_types.values())
+        if all(entity_type.max_span_size is None for entity_type in entity_types[1:]):
+            return None
+
+        no_limit = np.iinfo(np.int64).max
+        return torch.tensor([no_limit] + [entity_type.max_span_size if entity_type.max_span_size is not None
+                                          else no_limit for entity_type in entity_types[1:]], dtype=torch.long)
+
+    @property
+    def max_span_size(self):
+        return self._max_span_size
+
+    @property
+    def max_rel_distance(self):
+        return self._max_rel_distance
+
     @property
     def relation_type_count(self):
         return len(self._relation_types)
@@ -128,78 +272,137 @@ class BaseInputReader(ABC):
 
 class JsonInputReader(BaseInputReader):
     def __init__(self, types_path: str, tokenizer: BertTokenizer, neg_entity_count: int = None,
-                 neg_rel_count: int = None, max_span_size: int = None, logger: Logger = None):
-        super().__init__(types_path, tokenizer, neg_entity_count, neg_rel_count, max_span_size, logger)
+                 neg_rel_count: int = None, max_span_size: int = None, logger: Logger = None,
+                 cache_path: str = None, parse_processes: int = 0):
+        super().__init__(types_path, tokenizer, neg_entity_count, neg_rel_count, max_span_size, logger, cache_path)
+
+        # memoized byte-pair encodings of token phrases (few distinct phrases compared to token count)
+        self._token_encodings = dict()
+        self._parse_processes = parse_processes
+        self._parse_pool = None
 
     def read(self, dataset_paths):
-        for dataset_label, dataset_path in dataset_paths.items():
-            dataset = Dataset(dataset_label, self._relation_types, self._entity_types, self._neg_entity_count,
-                              self._neg_rel_count, self._max_span_size)
-            self._parse_dataset(dataset_path, dataset)
-            self._datasets[dataset_label] = dataset
+        try:
+            for dataset_label, dataset_path in dataset_paths.items():
+                if self._cache_path is not None:
+                    dataset = self._read_cached(dataset_label, dataset_path)
+                else:
+                    dataset = Dataset(dataset_label, self._relation_types, self._entity_types,
+                                      self._neg_entity_count, self._neg_rel_count, self._max_span_size)
+                    self._parse_dataset(dataset_path, dataset)
+
+                self._datasets[dataset_label] = dataset
+        finally:
+            self._close_parse_pool()
 
         self._context_size = self._calc_context_size(self._datasets.values())
 
-    def _parse_dataset(self, dataset_path, dataset):
-        documents = json.load(open(dataset_path))
-        for document in tqdm(documents, desc="Parse dataset '%s'" % dataset.label):
-            self._parse_document(document, dataset)
+    def _read_cached(self, dataset_label, dataset_path) -> MappedDataset:
+        cache_dir = os.path.join(self._cache_path, self.dataset_key(dataset_path))
 
-    def _parse_document(self, doc, dataset) -> Document:
-        jtokens = doc['tokens']
-        jrelations = doc['relations']
-        jentities = doc['entities']
+        if os.path.exists(os.path.join(cache_dir, MappedDataset.META_FILE)):
+            self._log("Load dataset '%s' from cache: %s" % (dataset_label, cache_dir))
+        else:
+            self._convert(dataset_label, dataset_path, cache_dir)
 
-        # parse tokens
-        doc_tokens, doc_encoding = self._parse_tokens(jtokens, dataset)
+        return MappedDataset(dataset_label, self._relation_types, self._entity_types, self._neg_entity_count,
+                             self._neg_rel_count, self._max_span_size, cache_dir)
 
-        # parse entity mentions
-        entities = self._parse_entities(jentities, doc_tokens, dataset)
+    def _convert(self, dataset_label, dataset_path, path, key: str = None):
+        dataset = Dataset(dataset_label, self._relation_types, self._entity_types, self._neg_entity_count,
+                          self._neg_rel_count, self._max_span_size)
+        self._parse_dataset(dataset_path, dataset)
 
-        # parse relations
-        relations = self._parse_relations(jrelations, entities, dataset)
+        # written to a temporary directory first (concurrent runs may convert the same dataset), the files of an
+        # existing conversion are never overwritten since other processes may have them memory-mapped
+        tmp_dir = '%s.%s.tmp' % (path, os.getpid())
+        MappedDataset.write(dataset, tmp_dir, key)
 
-        # create document
-        document = dataset.create_document(doc_tokens, entities, relations, doc_encoding)
+        try:
+            os.rename(tmp_dir, path)
+        except OSError:
+            shutil.rmtree(tmp_dir)
 
-        return document
+    def _parse_dataset(self, dataset_path, dataset):
+        for path in _dataset_files(dataset_path):
+            if self._parse_processes > 0:
+                # documents are parsed (decoded and tokenized) by parsing processes
+                parsed_documents = self._parse_parallel(path)
+            else:
+                parsed_documents = (self._parse_json(document) for document in _read_documents(path))
+
+            # dataset objects are created in file order (same IDs as serial parsing)
+            for parsed in tqdm(parsed_documents, desc="Parse dataset '%s'" % dataset.label):
+                self._create_document(parsed, dataset)
+
+    def _parse_parallel(self, path, chunk_size: int = 1000):
+        # the pool is created on first use and shared by all dataset files of a 'read' call
+        if self._parse_pool is None:
+            self._parse_pool = mp.get_context('fork').Pool(self._parse_processes, initializer=_init_parse_process,
+                                                           initargs=(self,))
+
+        # lines of JSON lines files are decoded by parsing processes
+        json_lines = _is_json_lines(path)
+        documents = _read_lines(path) if json_lines else _read_documents(path)
+        pending = collections.deque()
+
+        for chunk in _chunks(documents, chunk_size):
+            pending.append(self._parse_pool.apply_async(_parse_chunk, (chunk, json_lines)))
+
+            # limit chunks in memory
+            if len(pending) > 2 * self._parse_processes:
+                yield from pending.popleft().get()
+
+        while pending:
+            yield from pending.popleft().get()
+
+    def _close_parse_pool(self):
+        if self._parse_pool is not None:
+            self._parse_pool.terminate()
+            self._parse_pool.join()
+            self._parse_pool = None
+
+    def _parse_document(self, doc, dataset) -> Document:
+        return self._create_document(self._parse_json(doc), dataset)
 
-    def _parse_tokens(self, jtokens, dataset):
-        doc_tokens = []
+    def _parse_json(self, doc):
+        # plain arrays of a JSON document (independent of datasets, i.e. also created by parsing processes):
+        # token phrases, token spans [(start, end)], encoding, entities [(start, end, type)] and
+        # relations [(head, tail, type, reverse)]
+        phrases = doc['tokens']
+        token_spans, encoding = self._parse_tokens(phrases)
+        entities = [(e['start'], e['end'], self._entity_types[e['type']].index) for e in doc['entities']]
+        relations = self._parse_relations(doc['relations'], entities)
+
+        return phrases, token_spans, encoding, entities, relations
+
+    def _parse_tokens(self, jtokens):
+        token_spans = []
 
         # full document encoding including special tokens ([CLS] and [SEP]) and byte-pair encodings of original tokens
         doc_encoding = [self._tokenizer.convert_tokens_to_ids('[CLS]')]
 
-        # parse tokens
-        for i, token_phrase in enumerate(jtokens):
-            token_encoding = self._tokenizer.encode(token_phrase, add_special_tokens=False)
-            span_start, span_end = (len(doc_encoding), len(doc_encoding) + len(token_encoding))
+        # fast tokenizers encode unseen phrases of a document in one batch
+        if getattr(self._tokenizer, 'is_fast', False):
+            unseen = list({p: None for p in jtokens if p not in self._token_encodings})
+            if unseen:
+                self._token_encodings.update(zip(unseen, _encode_phrases(self._tokenizer, unseen)))
 
-            token = dataset.create_token(i, span_start, span_end, token_phrase)
+        # parse tokens
+        for token_phrase in jtokens:
+            token_encoding = self._token_encodings.get(token_phrase)
+            if token_encoding is None:
+                token_encoding = tuple(self._tokenizer.encode(token_phrase, add_special_tokens=False))
+                self._token_encodings[token_phrase] = token_encoding
 
-            doc_tokens.append(token)
+            token_spans.append((len(doc_encoding), len(doc_encoding) + len(token_encoding)))
             doc_encoding += token_encoding
 
         doc_encoding += [self._tokenizer.convert_tokens_to_ids('[SEP]')]
 
-        return doc_tokens, doc_encoding
-
-    def _parse_entities(self, jentities, doc_tokens, dataset) -> List[Entity]:
-        entities = []
-
-        for entity_idx, jentity in enumerate(jentities):
-            entity_type = self._entity_types[jentity['type']]
-            start, end = jentity['start'], jentity['end']
+        return token_spans, doc_encoding
 
-            # create entity mention
-            tokens = doc_tokens[start:end]
-            phrase = " ".join([t.phrase for t in tokens])
-            entity = dataset.create_entity(entity_type, tokens, phrase)
-            entities.append(entity)
-
-        return entities
-
-    def _parse_relations(self, jrelations, entities, dataset) -> List[Relation]:
+    def _parse_relations(self, jrelations, entities):
         relations = []
 
         for jrelation in jrelations:
@@ -208,17 +411,210 @@ class JsonInputReader(BaseInputReader):
             head_idx = jrelation['head']
             tail_idx = jrelation['tail']
 
-            # create relation
-            head = entities[head_idx]
-            tail = entities[tail_idx]
-
-            reverse = int(tail.tokens[0].index) < int(head.tokens[0].index)
+            # entities start at the index of their first token
+            reverse = entities[tail_idx][0] < entities[head_idx][0]
 
             # for symmetric relations: head occurs before tail in sentence
             if relation_type.symmetric and reverse:
-                head, tail = util.swap(head, tail)
+                head_idx, tail_idx = util.swap(head_idx, tail_idx)
 
-            relation = dataset.create_relation(relation_type, head_entity=head, tail_entity=tail, reverse=reverse)
-            relations.append(relation)
+            relations.append((head_idx, tail_idx, relation_type.index, reverse))
 
         return relations
+
+    def _create_document(self, parsed, dataset) -> Document:
+        phrases, token_spans, encoding, jentities, jrelations = parsed
+
+        # phrases are interned (shared by all occurrences of a token)
+        doc_tokens = [dataset.create_token(i, span_start, span_end, sys.intern(phrase))
+                      for i, (phrase, (span_start, span_end)) in enumerate(zip(phrases, token_spans))]
+
+        # entity mentions (views of document tokens)
+        entities = []
+        for start, end, type_idx in jentities:
+            tokens = TokenSpan(doc_tokens, start, end)
+            phrase = " ".join([t.phrase for t in tokens])
+            entities.append(dataset.create_entity(self._idx2entity_type[type_idx], tokens, phrase))
+
+        relations = [dataset.create_relation(self._idx2relation_type[type_idx], head_entity=entities[head_idx],
+                                             tail_entity=entities[tail_idx], reverse=reverse)
+                     for head_idx, tail_idx, type_idx, reverse in jrelations]
+
+        return dataset.create_document(doc_tokens, entities, relations, encoding)
+
+
+class BinaryInputReader(JsonInputReader):
+    """ Reads datasets as memory-mapped binary files (converted once from JSON, next to the JSON file) """
+    BINARY_SUFFIX = '.bin'
+
+    def read(self, dataset_paths):
+        try:
+            for dataset_label, dataset_path in dataset_paths.items():
+                if glob.has_magic(dataset_path):
+                    raise Exception("Binary datasets are converted from a single dataset file, not a glob pattern "
+                                    "('%s'), use 'dataset_cache_path' for sharded datasets" % dataset_path)
+
+                # one conversion per dataset key (dataset file, types and tokenizer), i.e. a changed dataset file or
+                # another tokenizer gets a new conversion instead of replacing one that may be in use
+                key = self.dataset_key(dataset_path)
+                binary_path = os.path.join(dataset_path + BinaryInputReader.BINARY_SUFFIX, key)
+
+                if not os.path.exists(os.path.join(binary_path, MappedDataset.META_FILE)):
+                    self._log("Convert dataset '%s' to binary: %s" % (dataset_label, binary_path))
+                    os.makedirs(os.path.dirname(binary_path), exist_ok=True)
+                    self._convert(dataset_label, dataset_path, binary_path, key)
+
+                self._datasets[dataset_label] = MappedDataset(dataset_label, self._relation_types, self._entity_types,
+                                                              self._neg_entity_count, self._neg_rel_count,
+                                                              self._max_span_size, binary_path)
+        finally:
+            self._close_parse_pool()
+
+        self._context_size = self._calc_context_size(self._datasets.values())
+
+
+class StreamingInputReader(JsonInputReader):
+    """ Reads datasets as streams of lazily parsed documents (counts and context size from a sidecar index) """
+    INDEX_SUFFIX = '.index.json'
+
+    def __init__(self, types_path: str, tokenizer: BertTokenizer, neg_entity_count: int = None,
+                 neg_rel_count: int = None, max_span_size: int = None, logger: Logger = None,
+                 cache_path: str = None, shuffle_buffer: int = 0):
+        super().__init__(types_path, tokenizer, neg_entity_count, neg_rel_count, max_span_size, logger, cache_path)
+        self._shuffle_buffer = shuffle_buffer
+
+    def read(self, dataset_paths):
+        for dataset_label, dataset_path in dataset_paths.items():
+            paths = _dataset_files(dataset_path)
+
+            # a JSON list is loaded as a whole (by every data loader worker), JSON lines are read incrementally
+            for path in paths:
+                if not _is_json_lines(path):
+                    raise Exception("Streamed datasets must be JSON lines (optionally compressed), got '%s'" % path)
+
+            indices = [self._read_index(dataset_label, path) for path in paths]
+
+            index = dict(document_count=sum(i['document_count'] for i in indices),
+                         entity_count=sum(i['entity_count'] for i in indices),
+                         relation_count=sum(i['relation_count'] for i in indices),
+                         context_size=max(i['context_size'] for i in indices))
+
+            dataset = StreamingDataset(dataset_label, self._relation_types, self._entity_types,
+                                       self._neg_entity_count, self._neg_rel_count, self._max_span_size,
+                                       lambda rnd, paths=paths: self._stream(paths, rnd), self._parse_document,
+                                       index, self._shuffle_buffer)
+            self._datasets[dataset_label] = dataset
+
+        self._context_size = self._calc_context_size(self._datasets.values())
+
+    def _stream(self, paths, rnd):
+        # files are read in random order if shuffling is enabled
+        paths = list(paths)
+        if self._shuffle_buffer > 1:
+            rnd.shuffle(paths)
+
+        # lines are decoded by the data loader worker they are assigned to
+        for path in paths:
+            yield from _read_lines(path)
+
+    def _read_index(self, dataset_label, path):
+        index_file = path + StreamingInputReader.INDEX_SUFFIX
+
+        # one full pass per file (if missing or outdated)
+        if not os.path.exists(index_file) or os.path.getmtime(index_file) < os.path.getmtime(path):
+            dataset = StreamingDataset(dataset_label, self._relation_types, self._entity_types,
+                                       self._neg_entity_count, self._neg_rel_count, self._max_span_size,
+                                       None, None, None)
+            index = dict(document_count=0, entity_count=0, relation_count=0, context_size=0)
+
+            for jdoc in tqdm(_read_documents(path), desc="Index dataset '%s'" % path):
+                doc = self._parse_document(jdoc, dataset)
+                index['document_count'] += 1
+                index['entity_count'] += len(doc.entities)
+                index['relation_count'] += len(doc.relations)
+                index['context_size'] = max(index['context_size'], len(doc.encoding))
+
+            json.dump(index, open(index_file, 'w'))
+
+        return json.load(open(index_file))
+
+
+def _encode_phrases(tokenizer, phrases):
+    # each phrase is encoded separately (also in batches of fast tokenizers)
+    if getattr(tokenizer, 'is_fast', False):
+        return [tuple(e) for e in tokenizer.batch_encode_plus(phrases, add_special_tokens=False)['input_ids']]
+
+    return [tuple(tokenizer.encode(p, add_special_tokens=False)) for p in phrases]
+
+
+# reader of a parsing process (forked, i.e. with types, tokenizer and memoized encodings)
+_parse_reader = None
+
+
+def _init_parse_process(reader):
+    global _parse_reader
+    _parse_reader = reader
+
+
+def _parse_chunk(documents, json_lines):
+    if json_lines:
+        documents = (json.loads(line) for line in documents)
+
+    return [_parse_reader._parse_json(document) for document in documents]
+
+
+def _chunks(items, chunk_size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def _dataset_files(dataset_path):
+    # a path or glob pattern (e.g. of sharded files), sidecar indices are skipped
+    if glob.has_magic(dataset_path):
+        paths = [path for path in sorted(glob.glob(dataset_path))
+                 if os.path.isfile(path) and not path.endswith(StreamingInputReader.INDEX_SUFFIX)]
+    else:
+        paths = [dataset_path]
+
+    if not paths:
+        raise Exception("No dataset files match '%s'" % dataset_path)
+
+    return paths
+
+
+_OPENERS = {'.gz': gzip.open, '.xz': lzma.open, '.bz2': bz2.open}
+
+
+def _is_json_lines(path):
+    base_path, ext = os.path.splitext(path)
+    return (base_path if ext in _OPENERS else path).endswith('.jsonl')
+
+
+def _read_documents(path):
+    # JSON (list of documents) or JSON lines, optionally compressed (gzip, xz, bz2)
+    if _is_json_lines(path):
+        for line in _read_lines(path):
+            yield json.loads(line)
+    else:
+        opener = _OPENERS.get(os.path.splitext(path)[1], open)
+
+        with opener(path, 'rt', encoding='utf-8') as f:
+            yield from json.load(f)
+
+
+def _read_lines(path):
+    # non-empty (undecoded) lines of a JSON lines file, optionally compressed
+    opener = _OPENERS.get(os.path.splitext(path)[1], open)
+
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield line
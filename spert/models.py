@@ -1,10 +1,10 @@
 import torch
 from torch import nn as nn
+from torch.nn import functional as F
 from transformers import BertConfig
 from transformers import BertModel
 from transformers import BertPreTrainedModel
 
-from spert import sampling
 from spert import util
 
 
@@ -28,7 +28,10 @@ class SpERT(BertPreTrainedModel):
 
     def __init__(self, config: BertConfig, cls_token: int, relation_types: int, entity_types: int,
                  size_embedding: int, prop_drop: float, freeze_transformer: bool, max_pairs: int = 100,
-                 pre_train: bool = False):
+                 pre_train: bool = False, window_size: int = None, window_overlap: int = None,
+                 window_batch_size: int = 8, max_rel_entities: int = None, min_rel_entity_score: float = 0.0,
+                 rel_signatures: torch.tensor = None, max_rel_distance: int = None,
+                 entity_size_limits: torch.tensor = None):
         super(SpERT, self).__init__(config)
 
         # BERT model
@@ -53,6 +56,31 @@ class SpERT(BertPreTrainedModel):
         self._entity_types = entity_types
         self._max_pairs = max_pairs
 
+        # longer encodings are split into overlapping windows (see '_encode')
+        self._window_size = window_size if window_size is not None else config.max_position_embeddings
+        self._window_overlap = window_overlap if window_overlap is not None else self._window_size // 4
+
+        self._window_batch_size = window_batch_size
+
+        if not 0 <= self._window_overlap < self._window_size - 2:
+            raise Exception("Window overlap must be smaller than window size - 2")
+
+        if self._window_batch_size < 1:
+            raise Exception("Window batch size must be positive")
+
+        # entity budget per document for relation candidates in evaluation (see '_filter_spans')
+        self._max_rel_entities = max_rel_entities
+        self._min_rel_entity_score = min_rel_entity_score
+
+        # possible relations [head entity type, tail entity type, relation type] (None = unconstrained)
+        self._rel_signatures = rel_signatures
+        # maximum number of tokens between the entities of relation candidates (None = unlimited)
+        self._max_rel_distance = max_rel_distance
+        # maximum span size of entity types [entity types] in evaluation (None = unconstrained)
+        self._entity_size_limits = entity_size_limits
+        self.pruning_counts = None
+        self.reset_pruning_counts()
+
         # weight initialization
         self.init_weights()
 
@@ -63,6 +91,11 @@ class SpERT(BertPreTrainedModel):
             for param in self.bert.parameters():
                 param.requires_grad = False
 
+    def reset_pruning_counts(self):
+        # candidates (entities/pairs) considered for relations in evaluation and how many of them were pruned
+        self.pruning_counts = dict(entities=0, pruned_entities=0, pairs=0, pruned_pairs=0, type_filtered_pairs=0,
+                                   distance_filtered_pairs=0)
+
     def _rel_layer(self):
         if self._pre_train:
             return self.pre_train_rel_layer
@@ -75,20 +108,76 @@ class SpERT(BertPreTrainedModel):
         else:
             return self.entity_layer
 
-    def _forward_train(self, encodings: torch.tensor, context_masks: torch.tensor, entity_masks: torch.tensor,
-                       entity_sizes: torch.tensor, relations: torch.tensor, rel_masks: torch.tensor):
+    def _encode(self, encodings: torch.tensor, context_masks: torch.tensor):
         # get contextualized token embeddings from last transformer layer
         context_masks = context_masks.float()
-        h = self.bert(input_ids=encodings, attention_mask=context_masks)[0]
+        context_size = encodings.shape[1]
+
+        if context_size <= self._window_size:
+            return self.bert(input_ids=encodings, attention_mask=context_masks)[0]
+
+        # documents are windowed by their own length (documents that fit are encoded in a single pass,
+        # independent of the other documents of the batch)
+        lengths = context_masks.sum(-1).long().tolist()
+        short_docs = [i for i, length in enumerate(lengths) if length <= self._window_size]
+        long_docs = [i for i, length in enumerate(lengths) if length > self._window_size]
+
+        h = None
+        if short_docs:
+            short_size = max(lengths[i] for i in short_docs)
+            h_short = self.bert(input_ids=encodings[short_docs, :short_size],
+                                attention_mask=context_masks[short_docs, :short_size])[0]
+            h = h_short.new_zeros(encodings.shape[0], context_size, h_short.shape[-1])
+            h[short_docs, :short_size] = h_short
+
+        # windows of [CLS] + a part of the document's encoding (between [CLS] and [SEP]) + [SEP],
+        # windows of all long documents are encoded in batches of at most 'window_batch_size' (no padding)
+        size = self._window_size - 2
+        stride = size - self._window_overlap
+        doc_starts = []
+        window_encodings = []
+
+        for i in long_docs:
+            content_size = lengths[i] - 2
+            starts = list(range(0, content_size - size, stride)) + [content_size - size]
+            cls, sep = encodings[i, :1], encodings[i, lengths[i] - 1:lengths[i]]
+            window_encodings.extend(torch.cat([cls, encodings[i, 1 + s:1 + s + size], sep]) for s in starts)
+            doc_starts.append(starts)
+
+        window_encodings = torch.stack(window_encodings)
+        h_windows = torch.cat([self.bert(input_ids=window_encodings[k:k + self._window_batch_size])[0]
+                               for k in range(0, window_encodings.shape[0], self._window_batch_size)])
+        if h is None:
+            h = h_windows.new_zeros(encodings.shape[0], context_size, h_windows.shape[-1])
+
+        # each token is taken from one window (the overlap of neighboring windows is split in the middle),
+        # so spans and relation pairs across window boundaries are not duplicated
+        w = 0
+        for i, starts in zip(long_docs, doc_starts):
+            content_size = lengths[i] - 2
+            bounds = [0] + [(starts[j + 1] + starts[j] + size) // 2 for j in range(len(starts) - 1)] + [content_size]
+
+            h_doc = [h_windows[w, :1]]
+            for j, s in enumerate(starts):
+                h_doc.append(h_windows[w + j, 1 + bounds[j] - s:1 + bounds[j + 1] - s])
+            h_doc.append(h_windows[w + len(starts) - 1, -1:])
+
+            h[i, :lengths[i]] = torch.cat(h_doc)
+            w += len(starts)
+
+        return h
+
+    def _forward_train(self, encodings: torch.tensor, context_masks: torch.tensor, entity_spans: torch.tensor,
+                       entity_sizes: torch.tensor, relations: torch.tensor, rel_ctx_spans: torch.tensor):
+        h = self._encode(encodings, context_masks)
 
         batch_size = encodings.shape[0]
 
         # classify entities
         size_embeddings = self.size_embeddings(entity_sizes)  # embed entity candidate sizes
-        entity_clf, entity_spans_pool = self._classify_entities(encodings, h, entity_masks, size_embeddings)
+        entity_clf, entity_spans_pool = self._classify_entities(encodings, h, entity_spans, size_embeddings)
 
         # classify relations
-        h_large = h.unsqueeze(1).repeat(1, max(min(relations.shape[1], self._max_pairs), 1), 1, 1)
         rel_clf = torch.zeros([batch_size, relations.shape[1], self._relation_types]).to(
             self._rel_layer().weight.device)
 
@@ -97,59 +186,96 @@ class SpERT(BertPreTrainedModel):
         for i in range(0, relations.shape[1], self._max_pairs):
             # classify relation candidates
             chunk_rel_logits = self._classify_relations(entity_spans_pool, size_embeddings,
-                                                        relations, rel_masks, h_large, i)
+                                                        relations, rel_ctx_spans, h, i)
             rel_clf[:, i:i + self._max_pairs, :] = chunk_rel_logits
 
         return entity_clf, rel_clf
 
-    def _forward_eval(self, encodings: torch.tensor, context_masks: torch.tensor, entity_masks: torch.tensor,
-                      entity_sizes: torch.tensor, entity_spans: torch.tensor, entity_sample_masks: torch.tensor):
-        # get contextualized token embeddings from last transformer layer
-        context_masks = context_masks.float()
-        h = self.bert(input_ids=encodings, attention_mask=context_masks)[0]
+    def _forward_eval(self, encodings: torch.tensor, context_masks: torch.tensor, entity_spans: torch.tensor,
+                      entity_sizes: torch.tensor, entity_sample_masks: torch.tensor):
+        h = self._encode(encodings, context_masks)
 
-        batch_size = encodings.shape[0]
-        ctx_size = context_masks.shape[-1]
+        batch_size, entity_count = entity_spans.shape[:2]
+
+        # packed layout: only actual candidates (no padding) of the batch are classified (flat with document
+        # indices), results are unpacked (padded) at the end
+        entity_docs, entity_positions = entity_sample_masks.nonzero().t()
+        entity_spans = entity_spans[entity_docs, entity_positions]
 
         # classify entities
+        entity_sizes = entity_sizes[entity_docs, entity_positions]
         size_embeddings = self.size_embeddings(entity_sizes)  # embed entity candidate sizes
-        entity_clf, entity_spans_pool = self._classify_entities(encodings, h, entity_masks, size_embeddings)
+        entity_clf, entity_spans_pool = self._classify_entities(encodings, h, entity_spans, size_embeddings,
+                                                                entity_docs=entity_docs)
+
+        if self._entity_size_limits is not None:
+            # entity types that do not occur with the size of a candidate ('None' type is always possible)
+            limits = self._entity_size_limits.to(entity_sizes.device)
+            entity_clf = entity_clf.masked_fill(entity_sizes.unsqueeze(-1) > limits, float('-inf'))
+
+        # apply softmax
+        entity_clf = torch.softmax(entity_clf, dim=-1)
 
         # ignore entity candidates that do not constitute an actual entity for relations (based on classifier)
-        relations, rel_masks, rel_sample_masks = self._filter_spans(entity_clf, entity_spans,
-                                                                    entity_sample_masks, ctx_size)
+        rel_docs, rel_positions, relations, rel_ctx_spans, rel_type_masks = self._filter_spans(
+            entity_clf, entity_spans, entity_docs, batch_size)
 
-        rel_sample_masks = rel_sample_masks.float().unsqueeze(-1)
-        h_large = h.unsqueeze(1).repeat(1, max(min(relations.shape[1], self._max_pairs), 1), 1, 1)
-        rel_clf = torch.zeros([batch_size, relations.shape[1], self._relation_types]).to(
-            self._rel_layer().weight.device)
+        h_table = util.range_max_table(h)  # relation contexts are pooled by range maximum queries
+        entity_proj = self._project_entities(entity_spans_pool, size_embeddings)
+        rel_clf = torch.zeros([relations.shape[0], self._relation_types]).to(self._rel_layer().weight.device)
 
         # obtain relation logits
         # chunk processing to reduce memory usage
-        for i in range(0, relations.shape[1], self._max_pairs):
+        for i in range(0, relations.shape[0], self._max_pairs):
             # classify relation candidates
-            chunk_rel_logits = self._classify_relations(entity_spans_pool, size_embeddings,
-                                                        relations, rel_masks, h_large, i)
+            chunk = slice(i, i + self._max_pairs)
+            chunk_rel_logits = self._score_relations(entity_proj, relations[chunk], rel_ctx_spans[chunk],
+                                                     rel_docs[chunk], h_table)
             # apply sigmoid
-            chunk_rel_clf = torch.sigmoid(chunk_rel_logits)
-            rel_clf[:, i:i + self._max_pairs, :] = chunk_rel_clf
+            rel_clf[chunk] = torch.sigmoid(chunk_rel_logits)
 
-        rel_clf = rel_clf * rel_sample_masks  # mask
+        if rel_type_masks is not None:
+            # relation types that are impossible for the entity types of a pair
+            rel_clf *= rel_type_masks.float()
 
-        # apply softmax
-        entity_clf = torch.softmax(entity_clf, dim=2)
+        # unpack (padded entries are zero)
+        batch_entity_clf = entity_clf.new_zeros([batch_size, entity_count, entity_clf.shape[-1]])
+        batch_entity_clf[entity_docs, entity_positions] = entity_clf
+
+        pair_count = max(int(rel_positions.max()) + 1, 1) if relations.shape[0] else 1
+        batch_rel_clf = rel_clf.new_zeros([batch_size, pair_count, self._relation_types])
+        batch_rel_clf[rel_docs, rel_positions] = rel_clf
+        batch_relations = relations.new_zeros([batch_size, pair_count, 2])
+        batch_relations[rel_docs, rel_positions] = entity_positions[relations]
 
-        return entity_clf, rel_clf, relations
+        return batch_entity_clf, batch_rel_clf, batch_relations
+
+    def _classify_entities(self, encodings, h, entity_spans, size_embeddings, entity_docs=None):
+        # entity_docs: document indices of packed (flat) candidates in evaluation
+        evaluate = entity_docs is not None
 
-    def _classify_entities(self, encodings, h, entity_masks, size_embeddings):
         # max pool entity candidate spans
-        m = (entity_masks.unsqueeze(-1) == 0).float() * (-1e30)
-        entity_spans_pool = m + h.unsqueeze(1).repeat(1, entity_masks.shape[1], 1, 1)
-        entity_spans_pool = entity_spans_pool.max(dim=2)[0]
+        if evaluate:
+            # all spans up to the maximum span size: incremental pooling over span sizes
+            entity_spans_pool = util.max_pool_spans(h, entity_spans, entity_docs)
+        else:
+            # sampled spans: masked max pooling that only keeps argmax indices for backward
+            entity_spans_pool = util.span_max_pool(h, entity_spans)
 
         # get cls token as candidate context representation
         entity_ctx = get_token(h, encodings, self._cls_token)
 
+        if evaluate:
+            # entity layer as sum of projections of its input blocks (context projected once per document)
+            weight, bias = self._entity_layer().weight, self._entity_layer().bias
+            hidden_size = h.shape[-1]
+
+            entity_clf = (F.linear(entity_ctx, weight[:, :hidden_size], bias)[entity_docs] +
+                          F.linear(entity_spans_pool, weight[:, hidden_size:2 * hidden_size]) +
+                          F.linear(size_embeddings, weight[:, 2 * hidden_size:]))
+
+            return entity_clf, entity_spans_pool
+
         # create candidate representations including context, max pooled span and size embedding
         entity_repr = torch.cat([entity_ctx.unsqueeze(1).repeat(1, entity_spans_pool.shape[1], 1),
                                  entity_spans_pool, size_embeddings], dim=2)
@@ -160,14 +286,41 @@ class SpERT(BertPreTrainedModel):
 
         return entity_clf, entity_spans_pool
 
-    def _classify_relations(self, entity_spans, size_embeddings, relations, rel_masks, h, chunk_start):
+    def _project_entities(self, entity_spans, size_embeddings):
+        # projections of entity candidates by the head and tail blocks of the relation layer
+        # (relation layer input: context, head span, tail span, head size, tail size)
+        weight = self._rel_layer().weight
+        hidden_size, size_embedding = entity_spans.shape[-1], size_embeddings.shape[-1]
+        size_start = 3 * hidden_size
+
+        head_proj = (F.linear(entity_spans, weight[:, hidden_size:2 * hidden_size]) +
+                     F.linear(size_embeddings, weight[:, size_start:size_start + size_embedding]))
+        tail_proj = (F.linear(entity_spans, weight[:, 2 * hidden_size:3 * hidden_size]) +
+                     F.linear(size_embeddings, weight[:, size_start + size_embedding:]))
+
+        return head_proj, tail_proj
+
+    def _score_relations(self, entity_proj, relations, rel_ctx_spans, rel_docs, h_table):
+        # relation layer as sum of projections of its input blocks (equal without dropout, i.e. in evaluation):
+        # projected head and tail candidates (see '_project_entities') plus projected relation context
+        # relations: packed pairs of (packed) entity candidates
+        head_proj, tail_proj = entity_proj
+
+        # max pooling by range maximum queries (context of adjacent entity candidates is zero)
+        rel_ctx = util.range_max(h_table, rel_ctx_spans, rel_docs)
+        weight, bias = self._rel_layer().weight, self._rel_layer().bias
+        ctx_proj = F.linear(rel_ctx, weight[:, :rel_ctx.shape[-1]], bias)
+
+        chunk_rel_logits = ctx_proj + head_proj[relations[:, 0]] + tail_proj[relations[:, 1]]
+        return chunk_rel_logits
+
+    def _classify_relations(self, entity_spans, size_embeddings, relations, rel_ctx_spans, h, chunk_start):
         batch_size = relations.shape[0]
 
         # create chunks if necessary
         if relations.shape[1] > self._max_pairs:
             relations = relations[:, chunk_start:chunk_start + self._max_pairs]
-            rel_masks = rel_masks[:, chunk_start:chunk_start + self._max_pairs]
-            h = h[:, :relations.shape[1], :]
+            rel_ctx_spans = rel_ctx_spans[:, chunk_start:chunk_start + self._max_pairs]
 
         # get pairs of entity candidate representations
         entity_pairs = util.batch_index(entity_spans, relations)
@@ -178,13 +331,10 @@ class SpERT(BertPreTrainedModel):
         size_pair_embeddings = size_pair_embeddings.view(batch_size, size_pair_embeddings.shape[1], -1)
 
         # relation context (context between entity candidate pair)
-        # mask non entity candidate tokens
-        m = ((rel_masks == 0).float() * (-1e30)).unsqueeze(-1)
-        rel_ctx = m + h
-        # max pooling
-        rel_ctx = rel_ctx.max(dim=2)[0]
+        # masked max pooling that only keeps argmax indices for backward
+        rel_ctx = util.span_max_pool(h, rel_ctx_spans)
         # set the context vector of neighboring or adjacent entity candidates to zero
-        rel_ctx[rel_masks.to(torch.uint8).any(-1) == 0] = 0
+        rel_ctx[rel_ctx_spans[..., 1] <= rel_ctx_spans[..., 0]] = 0
 
         # create relation candidate representations including context, max pooled entity candidate pairs
         # and corresponding size embeddings
@@ -195,49 +345,84 @@ class SpERT(BertPreTrainedModel):
         chunk_rel_logits = self._rel_layer()(rel_repr)
         return chunk_rel_logits
 
-    def _filter_spans(self, entity_clf, entity_spans, entity_sample_masks, ctx_size):
-        batch_size = entity_clf.shape[0]
-        entity_logits_max = entity_clf.argmax(dim=-1) * entity_sample_masks.long()  # get entity type (including none)
-        batch_relations = []
-        batch_rel_masks = []
-        batch_rel_sample_masks = []
-
-        for i in range(batch_size):
-            rels = []
-            rel_masks = []
-            sample_masks = []
-
-            # get spans classified as entities
-            non_zero_indices = (entity_logits_max[i] != 0).nonzero().view(-1)
-            non_zero_spans = entity_spans[i][non_zero_indices].tolist()
-            non_zero_indices = non_zero_indices.tolist()
-
-            # create relations and masks
-            for i1, s1 in zip(non_zero_indices, non_zero_spans):
-                for i2, s2 in zip(non_zero_indices, non_zero_spans):
-                    if i1 != i2:
-                        rels.append((i1, i2))
-                        rel_masks.append(sampling.create_rel_mask(s1, s2, ctx_size))
-                        sample_masks.append(1)
-
-            if not rels:
-                # case: no more than two spans classified as entities
-                batch_relations.append(torch.tensor([[0, 0]], dtype=torch.long))
-                batch_rel_masks.append(torch.tensor([[0] * ctx_size], dtype=torch.bool))
-                batch_rel_sample_masks.append(torch.tensor([0], dtype=torch.bool))
-            else:
-                # case: more than two spans classified as entities
-                batch_relations.append(torch.tensor(rels, dtype=torch.long))
-                batch_rel_masks.append(torch.stack(rel_masks))
-                batch_rel_sample_masks.append(torch.tensor(sample_masks, dtype=torch.bool))
-
-        # stack
-        device = self._rel_layer().weight.device
-        batch_relations = util.padded_stack(batch_relations).to(device)
-        batch_rel_masks = util.padded_stack(batch_rel_masks).to(device)
-        batch_rel_sample_masks = util.padded_stack(batch_rel_sample_masks).to(device)
-
-        return batch_relations, batch_rel_masks, batch_rel_sample_masks
+    def _filter_spans(self, entity_clf, entity_spans, entity_docs, batch_size):
+        # packed candidates: spans classified as entities (type other than none), in order of candidates
+        # (entity_clf: type probabilities, the probability of the predicted type is the entity score)
+        entity_scores, entity_types = entity_clf.max(dim=-1)
+        entities = (entity_types != 0).nonzero().view(-1)
+        counts = torch.bincount(entity_docs[entities], minlength=batch_size)
+        unpruned_counts = counts
+
+        # entity budget: keep entities with a minimum score, at most the top k (by score) of each document
+        if self._min_rel_entity_score > 0:
+            entities = entities[entity_scores[entities] >= self._min_rel_entity_score]
+
+        if self._max_rel_entities is not None:
+            # rank entities within their document by descending score
+            scores = entity_scores[entities].double()
+            ranked = entities[(entity_docs[entities].double() * 2 - scores).argsort()]
+            ranked_counts = torch.bincount(entity_docs[ranked], minlength=batch_size)
+            ranks = torch.arange(ranked.shape[0], device=ranked.device) - \
+                (torch.cumsum(ranked_counts, dim=0) - ranked_counts)[entity_docs[ranked]]
+            entities = ranked[ranks < self._max_rel_entities].sort()[0]
+
+        entity_docs = entity_docs[entities]
+        counts = torch.bincount(entity_docs, minlength=batch_size)
+        offsets = torch.cumsum(counts, dim=0) - counts
+
+        unpruned_pairs = (unpruned_counts * (unpruned_counts - 1)).sum().item()
+        self.pruning_counts['entities'] += unpruned_counts.sum().item()
+        self.pruning_counts['pruned_entities'] += (unpruned_counts - counts).sum().item()
+        self.pruning_counts['pairs'] += unpruned_pairs
+        self.pruning_counts['pruned_pairs'] += unpruned_pairs - (counts * (counts - 1)).sum().item()
+
+        # all ordered pairs of different entities of a document (first entity major), pair p of a document with
+        # c entities: first = p // (c - 1), second = p % (c - 1) (skipping first)
+        pair_counts = counts * (counts - 1)
+        rel_docs = torch.repeat_interleave(torch.arange(batch_size, device=entity_clf.device), pair_counts)
+        rel_positions = torch.arange(rel_docs.shape[0], device=entity_clf.device) - \
+            (torch.cumsum(pair_counts, dim=0) - pair_counts)[rel_docs]
+
+        others = counts[rel_docs] - 1
+        first, second = rel_positions // others.clamp(min=1), rel_positions % others.clamp(min=1)
+        second = second + (second >= first).long()
+
+        first = entities[offsets[rel_docs] + first]
+        second = entities[offsets[rel_docs] + second]
+
+        # context between entity spans (see 'sampling.create_rel_ctx_span')
+        spans1, spans2 = entity_spans[first], entity_spans[second]
+        before = spans1[:, 1] < spans2[:, 0]
+        rel_ctx_spans = torch.stack([torch.where(before, spans1[:, 1], spans2[:, 1]),
+                                     torch.where(before, spans2[:, 0], spans1[:, 0])], dim=-1)
+
+        possible, rel_type_masks = None, None
+        if self._rel_signatures is not None:
+            # drop pairs whose entity types cannot be related by any relation type
+            rel_type_masks = self._rel_signatures.to(entity_types.device)[entity_types[first], entity_types[second]]
+            possible = rel_type_masks.any(dim=-1)
+            self.pruning_counts['type_filtered_pairs'] += rel_docs.shape[0] - possible.sum().item()
+
+        if self._max_rel_distance is not None:
+            # drop pairs of distant entities (tokens in between)
+            near = (rel_ctx_spans[:, 1] - rel_ctx_spans[:, 0]) <= self._max_rel_distance
+            self.pruning_counts['distance_filtered_pairs'] += (~near if possible is None else
+                                                               possible & ~near).sum().item()
+            possible = near if possible is None else possible & near
+
+        if possible is not None:
+            rel_docs, first, second = rel_docs[possible], first[possible], second[possible]
+            rel_ctx_spans = rel_ctx_spans[possible]
+            rel_type_masks = rel_type_masks[possible] if rel_type_masks is not None else None
+
+            # positions of remaining pairs within their document
+            rel_counts = torch.bincount(rel_docs, minlength=batch_size)
+            rel_positions = torch.arange(rel_docs.shape[0], device=rel_docs.device) - \
+                (torch.cumsum(rel_counts, dim=0) - rel_counts)[rel_docs]
+
+        relations = torch.stack([first, second], dim=-1)
+
+        return rel_docs, rel_positions, relations, rel_ctx_spans, rel_type_masks
 
     def forward(self, *args, evaluate=False, **kwargs):
         if not evaluate:
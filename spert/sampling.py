@@ -1,83 +1,136 @@
+import hashlib
+import os
+import queue
 import random
+import threading
+import traceback
+from collections import OrderedDict, deque
 
+import numpy as np
 import torch
+import torch.multiprocessing as mp
+from torch.utils.data import Sampler, get_worker_info
 
 from spert import util
 
 
-def create_train_sample(doc, neg_entity_count: int, neg_rel_count: int, max_span_size: int, rel_type_count: int):
+def create_train_candidates(doc, max_span_size: int, rel_signatures: np.ndarray = None,
+                            max_rel_distance: int = None):
+    """ Create the static (epoch independent) sampling data of a document, reused by 'create_train_sample' """
+    # rel_signatures: mask of entity type pairs [head type, tail type] that can be related (None = all pairs)
+    # max_rel_distance: maximum number of tokens between the entities of negative relations (None = unlimited)
     encodings = doc.encoding
-    token_count = len(doc.tokens)
     context_size = len(encodings)
 
-    # positive entities
-    pos_entity_spans, pos_entity_types, pos_entity_masks, pos_entity_sizes = [], [], [], []
-    for e in doc.entities:
-        pos_entity_spans.append(e.span)
-        pos_entity_types.append(e.entity_type.index)
-        pos_entity_masks.append(create_entity_mask(*e.span, context_size))
-        pos_entity_sizes.append(len(e.tokens))
+    token_starts = np.array([t.span_start for t in doc.tokens], dtype=np.int64)
+    token_ends = np.array([t.span_end for t in doc.tokens], dtype=np.int64)
 
-    # positive relations
-    pos_rels, pos_rel_spans, pos_rel_types, pos_rel_masks = [], [], [], []
-    for rel in doc.relations:
-        s1, s2 = rel.head_entity.span, rel.tail_entity.span
-        pos_rels.append((pos_entity_spans.index(s1), pos_entity_spans.index(s2)))
-        pos_rel_spans.append((s1, s2))
-        pos_rel_types.append(rel.relation_type)
-        pos_rel_masks.append(create_rel_mask(s1, s2, context_size))
-
-    # negative entities
-    neg_entity_spans, neg_entity_sizes = [], []
-    for size in range(1, max_span_size + 1):
-        for i in range(0, (token_count - size) + 1):
-            span = doc.tokens[i:i + size].span
-            if span not in pos_entity_spans:
-                neg_entity_spans.append(span)
-                neg_entity_sizes.append(size)
+    # positive entities
+    # entities sharing a span are referenced by their first occurrence (as in relations)
+    entity_count = len(doc.entities)
+    pos_entity_spans = np.zeros([entity_count, 2], dtype=np.int64)
+    pos_entity_types = np.zeros([entity_count], dtype=np.int64)
+    pos_entity_sizes = np.zeros([entity_count], dtype=np.int64)
+    span_indices = dict()
 
-    # sample negative entities
-    neg_entity_samples = random.sample(list(zip(neg_entity_spans, neg_entity_sizes)),
-                                       min(len(neg_entity_spans), neg_entity_count))
-    neg_entity_spans, neg_entity_sizes = zip(*neg_entity_samples) if neg_entity_samples else ([], [])
+    for i, e in enumerate(doc.entities):
+        pos_entity_spans[i] = e.span
+        pos_entity_types[i] = e.entity_type.index
+        pos_entity_sizes[i] = len(e.tokens)
+        span_indices.setdefault(e.span, i)
 
-    neg_entity_masks = [create_entity_mask(*span, context_size) for span in neg_entity_spans]
-    neg_entity_types = [0] * len(neg_entity_spans)
+    first_indices = np.array([span_indices[e.span] for e in doc.entities], dtype=np.int64)
 
-    # negative relations
+    # positive relations
+    rel_count = len(doc.relations)
+    pos_rels = np.zeros([rel_count, 2], dtype=np.int64)
+    pos_rel_types = np.zeros([rel_count], dtype=np.int64)
+    related = np.zeros([entity_count, entity_count], dtype=bool)
+    symmetric = np.zeros([entity_count, entity_count], dtype=bool)
+
+    for i, rel in enumerate(doc.relations):
+        head, tail = span_indices[rel.head_entity.span], span_indices[rel.tail_entity.span]
+        pos_rels[i] = head, tail
+        pos_rel_types[i] = rel.relation_type.index
+
+        # symmetry is decided by the first relation between two spans
+        if not related[head, tail]:
+            related[head, tail] = True
+            symmetric[head, tail] = rel.relation_type.symmetric
+
+    # negative entity candidates
+    # candidates are not materialized but enumerated in closed form (see '_span_candidates')
+    # only the (sorted) indices of candidates that match a positive entity span are kept for exclusion
+    candidate_offsets = _span_candidate_offsets(len(token_starts), max_span_size)
+    candidate_spans, _ = _span_candidates(np.arange(candidate_offsets[-1]), candidate_offsets,
+                                          token_starts, token_ends)
+    excluded = np.isin(_span_keys(candidate_spans, context_size), _span_keys(pos_entity_spans, context_size))
+    excluded = excluded.nonzero()[0]
+
+    # negative relation candidates
     # use only strong negative relations, i.e. pairs of actual (labeled) entities that are not related
-    neg_rel_spans = []
+    # do not add as negative relation sample:
+    # neg. relations from an entity to itself
+    # entity pairs that are related according to gt
+    # entity pairs whose reverse exists as a symmetric relation in gt
+    heads, tails = np.meshgrid(first_indices, first_indices, indexing='ij')
+    valid = (heads != tails) & ~related[heads, tails] & ~symmetric[tails, heads]
+
+    # entity pairs whose types cannot be related (according to relation signatures)
+    if rel_signatures is not None:
+        valid &= rel_signatures[pos_entity_types[heads], pos_entity_types[tails]]
+    neg_rels = np.stack([heads[valid], tails[valid]], axis=-1).reshape(-1, 2)
+    neg_rel_ctx_spans = create_rel_ctx_spans(pos_entity_spans[neg_rels[:, 0]], pos_entity_spans[neg_rels[:, 1]])
+
+    # entity pairs that are too far apart (as relation candidates in evaluation)
+    if max_rel_distance is not None:
+        near = (neg_rel_ctx_spans[:, 1] - neg_rel_ctx_spans[:, 0]) <= max_rel_distance
+        neg_rels, neg_rel_ctx_spans = neg_rels[near], neg_rel_ctx_spans[near]
+
+    return dict(pos_entity_spans=pos_entity_spans, pos_entity_types=pos_entity_types,
+                pos_entity_sizes=pos_entity_sizes, pos_rels=pos_rels, pos_rel_types=pos_rel_types,
+                pos_rel_ctx_spans=create_rel_ctx_spans(pos_entity_spans[pos_rels[:, 0]],
+                                                       pos_entity_spans[pos_rels[:, 1]]),
+                token_starts=token_starts, token_ends=token_ends, candidate_offsets=candidate_offsets,
+                # j-th non excluded candidate = j + number of exclusion offsets <= j
+                neg_entity_exclusions=excluded - np.arange(len(excluded)),
+                neg_entity_count=candidate_offsets[-1] - len(excluded),
+                neg_rels=neg_rels, neg_rel_ctx_spans=neg_rel_ctx_spans)
+
+
+def create_train_sample(doc, neg_entity_count: int, neg_rel_count: int, max_span_size: int, rel_type_count: int,
+                        candidates: dict = None, rel_signatures: np.ndarray = None, max_rel_distance: int = None):
+    if candidates is None:
+        candidates = create_train_candidates(doc, max_span_size, rel_signatures, max_rel_distance)
 
-    for i1, s1 in enumerate(pos_entity_spans):
-        for i2, s2 in enumerate(pos_entity_spans):
-            rev = (s2, s1)
-            rev_symmetric = rev in pos_rel_spans and pos_rel_types[pos_rel_spans.index(rev)].symmetric
+    encodings = doc.encoding
+    context_size = len(encodings)
 
-            # do not add as negative relation sample:
-            # neg. relations from an entity to itself
-            # entity pairs that are related according to gt
-            # entity pairs whose reverse exists as a symmetric relation in gt
-            if s1 != s2 and (s1, s2) not in pos_rel_spans and not rev_symmetric:
-                neg_rel_spans.append((s1, s2))
+    # sample negative entities
+    # draw from the index range of non positive candidates and map the drawn indices to spans
+    neg_samples = random.sample(range(candidates['neg_entity_count']),
+                                min(candidates['neg_entity_count'], neg_entity_count))
+    neg_samples = np.array(neg_samples, dtype=np.int64)
+    neg_samples += np.searchsorted(candidates['neg_entity_exclusions'], neg_samples, side='right')
+    neg_entity_spans, neg_entity_sizes = _span_candidates(neg_samples, candidates['candidate_offsets'],
+                                                          candidates['token_starts'], candidates['token_ends'])
 
     # sample negative relations
-    neg_rel_spans = random.sample(neg_rel_spans, min(len(neg_rel_spans), neg_rel_count))
-
-    neg_rels = [(pos_entity_spans.index(s1), pos_entity_spans.index(s2)) for s1, s2 in neg_rel_spans]
-    neg_rel_masks = [create_rel_mask(*spans, context_size) for spans in neg_rel_spans]
-    neg_rel_types = [0] * len(neg_rel_spans)
+    neg_rel_samples = random.sample(range(len(candidates['neg_rels'])),
+                                    min(len(candidates['neg_rels']), neg_rel_count))
+    neg_rel_samples = np.array(neg_rel_samples, dtype=np.int64)
 
     # merge
-    entity_types = pos_entity_types + neg_entity_types
-    entity_masks = pos_entity_masks + neg_entity_masks
-    entity_sizes = pos_entity_sizes + list(neg_entity_sizes)
+    entity_types = np.concatenate([candidates['pos_entity_types'], np.zeros_like(neg_entity_sizes)])
+    entity_spans = np.concatenate([candidates['pos_entity_spans'], neg_entity_spans])
+    entity_sizes = np.concatenate([candidates['pos_entity_sizes'], neg_entity_sizes])
 
-    rels = pos_rels + neg_rels
-    rel_types = [r.index for r in pos_rel_types] + neg_rel_types
-    rel_masks = pos_rel_masks + neg_rel_masks
+    rels = np.concatenate([candidates['pos_rels'], candidates['neg_rels'][neg_rel_samples]])
+    rel_types = np.concatenate([candidates['pos_rel_types'], np.zeros_like(neg_rel_samples)])
+    rel_ctx_spans = np.concatenate([candidates['pos_rel_ctx_spans'], candidates['neg_rel_ctx_spans'][neg_rel_samples]])
 
-    assert len(entity_masks) == len(entity_sizes) == len(entity_types)
-    assert len(rels) == len(rel_masks) == len(rel_types)
+    assert len(entity_spans) == len(entity_sizes) == len(entity_types)
+    assert len(rels) == len(rel_ctx_spans) == len(rel_types)
 
     # create tensors
     # token indices
@@ -90,28 +143,28 @@ def create_train_sample(doc, neg_entity_count: int, neg_rel_count: int, max_span
     # tensors to mask entity/relation samples of batch
     # since samples are stacked into batches, "padding" entities/relations possibly must be created
     # these are later masked during loss computation
-    if entity_masks:
-        entity_types = torch.tensor(entity_types, dtype=torch.long)
-        entity_masks = torch.stack(entity_masks)
-        entity_sizes = torch.tensor(entity_sizes, dtype=torch.long)
-        entity_sample_masks = torch.ones([entity_masks.shape[0]], dtype=torch.bool)
+    if len(entity_spans):
+        entity_types = torch.from_numpy(entity_types)
+        entity_spans = torch.from_numpy(entity_spans)
+        entity_sizes = torch.from_numpy(entity_sizes)
+        entity_sample_masks = torch.ones([entity_spans.shape[0]], dtype=torch.bool)
     else:
         # corner case handling (no pos/neg entities)
         entity_types = torch.zeros([1], dtype=torch.long)
-        entity_masks = torch.zeros([1, context_size], dtype=torch.bool)
+        entity_spans = torch.zeros([1, 2], dtype=torch.long)
         entity_sizes = torch.zeros([1], dtype=torch.long)
         entity_sample_masks = torch.zeros([1], dtype=torch.bool)
 
-    if rels:
-        rels = torch.tensor(rels, dtype=torch.long)
-        rel_masks = torch.stack(rel_masks)
-        rel_types = torch.tensor(rel_types, dtype=torch.long)
+    if len(rels):
+        rels = torch.from_numpy(rels)
+        rel_ctx_spans = torch.from_numpy(rel_ctx_spans)
+        rel_types = torch.from_numpy(rel_types)
         rel_sample_masks = torch.ones([rels.shape[0]], dtype=torch.bool)
     else:
         # corner case handling (no pos/neg relations)
         rels = torch.zeros([1, 2], dtype=torch.long)
         rel_types = torch.zeros([1], dtype=torch.long)
-        rel_masks = torch.zeros([1, context_size], dtype=torch.bool)
+        rel_ctx_spans = torch.zeros([1, 2], dtype=torch.long)
         rel_sample_masks = torch.zeros([1], dtype=torch.bool)
 
     # relation types to one-hot encoding
@@ -119,9 +172,9 @@ def create_train_sample(doc, neg_entity_count: int, neg_rel_count: int, max_span
     rel_types_onehot.scatter_(1, rel_types.unsqueeze(1), 1)
     rel_types_onehot = rel_types_onehot[:, 1:]  # all zeros for 'none' relation
 
-    return dict(encodings=encodings, context_masks=context_masks, entity_masks=entity_masks,
+    return dict(encodings=encodings, context_masks=context_masks, entity_spans=entity_spans,
                 entity_sizes=entity_sizes, entity_types=entity_types,
-                rels=rels, rel_masks=rel_masks, rel_types=rel_types_onehot,
+                rels=rels, rel_ctx_spans=rel_ctx_spans, rel_types=rel_types_onehot,
                 entity_sample_masks=entity_sample_masks, rel_sample_masks=rel_sample_masks)
 
 
@@ -132,14 +185,12 @@ def create_eval_sample(doc, max_span_size: int):
 
     # create entity candidates
     entity_spans = []
-    entity_masks = []
     entity_sizes = []
 
     for size in range(1, max_span_size + 1):
         for i in range(0, (token_count - size) + 1):
             span = doc.tokens[i:i + size].span
             entity_spans.append(span)
-            entity_masks.append(create_entity_mask(*span, context_size))
             entity_sizes.append(size)
 
     # create tensors
@@ -153,49 +204,357 @@ def create_eval_sample(doc, max_span_size: int):
     context_masks[:len(_encoding)] = 1
 
     # entities
-    if entity_masks:
-        entity_masks = torch.stack(entity_masks)
+    if entity_spans:
         entity_sizes = torch.tensor(entity_sizes, dtype=torch.long)
         entity_spans = torch.tensor(entity_spans, dtype=torch.long)
 
         # tensors to mask entity samples of batch
         # since samples are stacked into batches, "padding" entities possibly must be created
         # these are later masked during evaluation
-        entity_sample_masks = torch.tensor([1] * entity_masks.shape[0], dtype=torch.bool)
+        entity_sample_masks = torch.tensor([1] * entity_spans.shape[0], dtype=torch.bool)
     else:
         # corner case handling (no entities)
-        entity_masks = torch.zeros([1, context_size], dtype=torch.bool)
         entity_sizes = torch.zeros([1], dtype=torch.long)
         entity_spans = torch.zeros([1, 2], dtype=torch.long)
         entity_sample_masks = torch.zeros([1], dtype=torch.bool)
 
-    return dict(encodings=encodings, context_masks=context_masks, entity_masks=entity_masks,
-                entity_sizes=entity_sizes, entity_spans=entity_spans, entity_sample_masks=entity_sample_masks)
+    return dict(encodings=encodings, context_masks=context_masks, entity_sizes=entity_sizes,
+                entity_spans=entity_spans, entity_sample_masks=entity_sample_masks)
+
+
+class SamplingPool:
+    """ Long-lived sampling processes, shared across epochs and datasets (train/eval)
+
+    At most 'limit' batches are sampled ahead. A background thread moves sampled batches to the target device
+    while the current batch is processed. Batches are pinned to processes by their position, so the (fixed)
+    evaluation batches of repeated validation passes are sampled by the same process and hit its sample cache.
+    """
+
+    def __init__(self, datasets: dict, processes: int, limit: int, poll_interval: float = 5.0):
+        self._limit = max(limit, 1)
+        self._poll_interval = poll_interval
+        self._workers = []
+        self._tasks = []
+        self._results = None
+        self._task_id = 0
+
+        if processes > 0:
+            # processes are forked once and keep a copy of the datasets (including sampling caches)
+            context = mp.get_context('fork')
+            self._results = context.Queue()
+
+            for _ in range(processes):
+                tasks = context.Queue()
+                worker = context.Process(target=_sampling_process, args=(datasets, tasks, self._results),
+                                         daemon=True)
+                worker.start()
+
+                self._workers.append(worker)
+                self._tasks.append(tasks)
+
+    def iterate(self, dataset, mode: str, batches, device):
+        # batches: lists of document indices
+        batches = list(batches)
+        seeds = [random.getrandbits(32) for _ in batches] if self._workers else None
+        dataset.switch_mode(mode)
+
+        items = queue.Queue(maxsize=1)
+        thread = threading.Thread(target=self._produce, args=(dataset, mode, batches, seeds, device, items),
+                                  daemon=True)
+        thread.start()
+
+        while True:
+            item = items.get()
+
+            if item is None:
+                break
+            elif isinstance(item, Exception):
+                raise item
+
+            yield item
+
+        thread.join()
+
+    def close(self):
+        for tasks in self._tasks:
+            tasks.put(None)
+
+        for worker in self._workers:
+            worker.join()
+
+        self._workers, self._tasks = [], []
+
+    def _produce(self, dataset, mode, batches, seeds, device, items):
+        try:
+            if not self._workers:
+                for indices in batches:
+                    batch = collate_fn_padding([dataset[i] for i in indices])
+                    items.put(util.to_device(batch, device))
+            else:
+                pending = deque()
+                done = dict()
+                for position, (indices, seed) in enumerate(zip(batches, seeds)):
+                    pending.append(self._submit(position, (dataset.label, mode, indices, seed)))
+
+                    if len(pending) >= self._limit:
+                        items.put(util.to_device(self._get(pending.popleft(), pending, done), device))
+
+                while pending:
+                    items.put(util.to_device(self._get(pending.popleft(), pending, done), device))
+        except Exception as e:
+            items.put(e)
+            return
+
+        items.put(None)
+
+    def _submit(self, position, args):
+        # batches are assigned to processes round robin by their position (deterministic for evaluation batches)
+        task_id = self._task_id
+        self._task_id += 1
+
+        self._tasks[position % len(self._tasks)].put((task_id, args))
+        return task_id
+
+    def _get(self, task_id, pending, done):
+        # results arrive in order of completion, results of abandoned iterations are dropped
+        while task_id not in done:
+            try:
+                result_id, result = self._results.get(timeout=self._poll_interval)
+            except queue.Empty:
+                dead = [worker for worker in self._workers if worker.exitcode is not None]
+                if dead:
+                    # batches of a dead process (e.g. killed when out of memory) are lost
+                    raise Exception("Sampling process %s exited unexpectedly (exit code %s)"
+                                    % (dead[0].pid, dead[0].exitcode))
+                continue
+
+            if result_id == task_id or result_id in pending:
+                done[result_id] = result
+
+        result = done.pop(task_id)
+        if isinstance(result, Exception):
+            raise result
+
+        return result
+
+
+_sampling_datasets = None
+
+
+def _sampling_process(datasets, tasks, results):
+    global _sampling_datasets
+    _sampling_datasets = datasets
+
+    while True:
+        task = tasks.get()
+
+        if task is None:
+            break
+
+        task_id, args = task
+        try:
+            result = _sample_batch(*args)
+        except Exception:
+            result = Exception("Sampling failed: %s" % traceback.format_exc())
+
+        results.put((task_id, result))
+
+
+def _sample_batch(dataset_label, mode, indices, seed):
+    # seeded per batch: samples do not depend on which process creates the batch
+    random.seed(seed)
+
+    dataset = _sampling_datasets[dataset_label]
+    dataset.switch_mode(mode)
+
+    return collate_fn_padding([dataset[i] for i in indices], shared=True)
 
 
-def create_entity_mask(start, end, context_size):
-    mask = torch.zeros(context_size, dtype=torch.bool)
-    mask[start:end] = 1
-    return mask
+class TrainBatchSampler(Sampler):
+    """ Packs training documents into batches of similar shape up to a budget of padded batch size """
 
+    def __init__(self, dataset, budget: int, max_span_size: int, neg_entity_count: int, epochs: int,
+                 bucket_size: int = 100):
+        self._budget = budget
+        self._bucket_size = bucket_size
 
-def create_rel_mask(s1, s2, context_size):
+        # padded batch size: batch size x context size x entity samples (positive + sampled negative entities)
+        self._context_sizes = []
+        self._entity_counts = []
+
+        for token_count, encoding_size, entity_count in zip(dataset.doc_token_counts.tolist(),
+                                                            dataset.doc_encoding_sizes.tolist(),
+                                                            dataset.doc_entity_counts.tolist()):
+            max_size = min(max_span_size, token_count)
+            candidate_count = max_size * token_count - (max_size * (max_size - 1)) // 2
+
+            self._context_sizes.append(encoding_size)
+            self._entity_counts.append(entity_count + min(neg_entity_count, candidate_count))
+
+        # batches of all epochs are planned in advance to get the exact count of updates (learning rate schedule)
+        self._epochs = [self._plan_epoch() for _ in range(epochs)]
+        self._epoch = 0
+
+    def set_epoch(self, epoch: int):
+        self._epoch = epoch
+
+    def _plan_epoch(self):
+        order = list(range(len(self._context_sizes)))
+        random.shuffle(order)
+
+        # sort shuffled buckets of documents by shape and pack them greedily
+        batches = []
+        for i in range(0, len(order), self._bucket_size):
+            bucket = sorted(order[i:i + self._bucket_size],
+                            key=lambda k: (self._context_sizes[k], self._entity_counts[k]))
+
+            batch, context_size, entity_count = [], 0, 0
+            for k in bucket:
+                context_size = max(context_size, self._context_sizes[k])
+                entity_count = max(entity_count, self._entity_counts[k])
+
+                if batch and (len(batch) + 1) * context_size * entity_count > self._budget:
+                    batches.append(batch)
+                    batch, context_size, entity_count = [], self._context_sizes[k], self._entity_counts[k]
+
+                batch.append(k)
+
+            if batch:
+                batches.append(batch)
+
+        random.shuffle(batches)
+        return batches
+
+    @property
+    def batch_count(self):
+        # total count of batches (i.e. updates) over all epochs
+        return sum(len(batches) for batches in self._epochs)
+
+    def __iter__(self):
+        return iter(self._epochs[self._epoch])
+
+    def __len__(self):
+        return len(self._epochs[self._epoch])
+
+
+class EvalBatchSampler(Sampler):
+    """ Batches documents of similar shape for evaluation to reduce padding """
+
+    def __init__(self, dataset, batch_size: int):
+        # the count of entity candidates only depends on the token count (given the maximum span size)
+        token_counts, encoding_sizes = dataset.doc_token_counts.tolist(), dataset.doc_encoding_sizes.tolist()
+        order = sorted(range(len(token_counts)), key=lambda i: (token_counts[i], encoding_sizes[i]))
+
+        self._batches = [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+    def __iter__(self):
+        return iter(self._batches)
+
+    def __len__(self):
+        return len(self._batches)
+
+
+class EvalSampleCache:
+    """ LRU cache of evaluation samples, optionally backed by a directory on disc """
+
+    def __init__(self, max_span_size: int, size: int, path: str = None):
+        self._max_span_size = max_span_size
+        self._size = size
+        self._path = util.create_directories_dir(path) if path else None
+
+        self._samples = OrderedDict()
+        self._keys = dict()
+
+    def get(self, doc):
+        key = self._key(doc)
+
+        if key in self._samples:
+            self._samples.move_to_end(key)
+            return self._samples[key]
+
+        sample = None
+        file_path = os.path.join(self._path, '%s.pt' % key) if self._path is not None else None
+
+        if file_path is not None and os.path.exists(file_path):
+            sample = torch.load(file_path)
+
+        if sample is None:
+            sample = create_eval_sample(doc, self._max_span_size)
+
+            if file_path is not None:
+                # write to temporary file first since sampling processes may store the same sample concurrently
+                tmp_path = '%s.%s.tmp' % (file_path, os.getpid())
+                torch.save(sample, tmp_path)
+                os.replace(tmp_path, file_path)
+
+        if self._size > 0:
+            self._samples[key] = sample
+
+            if len(self._samples) > self._size:
+                self._samples.popitem(last=False)
+
+        return sample
+
+    def set_max_span_size(self, max_span_size: int):
+        # cached samples (in memory) of another maximum span size are dropped, keys on disc include the size
+        self._max_span_size = max_span_size
+        self._samples = OrderedDict()
+        self._keys = dict()
+
+    def _key(self, doc):
+        # eval samples only depend on the document's encoding, its token spans and the maximum span size
+        if doc.doc_id not in self._keys:
+            content = np.array(doc.encoding + [t for token in doc.tokens for t in token.span] +
+                               [self._max_span_size], dtype=np.int64)
+            self._keys[doc.doc_id] = hashlib.sha1(content.tobytes()).hexdigest()
+
+        return self._keys[doc.doc_id]
+
+
+def create_rel_ctx_span(s1, s2):
+    # (start, end) of the context between two entity spans
+    # empty (end <= start) for adjacent or overlapping spans
     start = s1[1] if s1[1] < s2[0] else s2[1]
     end = s2[0] if s1[1] < s2[0] else s1[0]
-    mask = create_entity_mask(start, end, context_size)
-    return mask
+    return start, end
+
+
+def create_rel_ctx_spans(spans1, spans2):
+    # vectorized version of 'create_rel_ctx_span' for span arrays of shape [N, 2]
+    before = spans1[:, 1] < spans2[:, 0]
+    start = np.where(before, spans1[:, 1], spans2[:, 1])
+    end = np.where(before, spans2[:, 0], spans1[:, 0])
+    return np.stack([start, end], axis=-1).reshape(-1, 2)
+
+
+def _span_candidate_offsets(token_count, max_span_size):
+    # candidates are enumerated by span size (1 to max_span_size) and start token
+    # candidates of size s occupy indices [offsets[s - 1], offsets[s])
+    sizes = np.arange(1, min(max_span_size, token_count) + 1)
+    return np.concatenate([[0], np.cumsum(token_count - sizes + 1)]).astype(np.int64)
 
 
-def collate_fn_padding(batch):
+def _span_candidates(indices, offsets, token_starts, token_ends):
+    # map candidate indices to (start, end) spans and sizes
+    sizes = np.searchsorted(offsets, indices, side='right')
+    starts = indices - offsets[sizes - 1]
+    spans = np.stack([token_starts[starts], token_ends[starts + sizes - 1]], axis=-1).reshape(-1, 2)
+    return spans, sizes.astype(np.int64)
+
+
+def _span_keys(spans, context_size):
+    return spans[:, 0] * (context_size + 1) + spans[:, 1]
+
+
+def collate_fn_padding(batch, shared: bool = None):
     padded_batch = dict()
     keys = batch[0].keys()
 
-    for key in keys:
-        samples = [s[key] for s in batch]
+    # within sampling processes, batches are created in shared memory to avoid copying them to the main process
+    if shared is None:
+        shared = get_worker_info() is not None
 
-        if not batch[0][key].shape:
-            padded_batch[key] = torch.stack(samples)
-        else:
-            padded_batch[key] = util.padded_stack([s[key] for s in batch])
+    for key in keys:
+        padded_batch[key] = util.padded_stack([s[key] for s in batch], shared=shared)
 
     return padded_batch
@@ -0,0 +1,106 @@
+import math
+import os
+import random
+import time
+
+import torch
+
+from spert import sampling
+from spert import util
+from spert.entities import Dataset
+
+PLAN_FILE = 'plan.pt'
+SHARD_FILE = 'epoch_%s_shard_%s.pt'
+
+
+def create_plan(dataset: Dataset, epochs: int, batch_size: int, shard_size: int,
+                batch_sampler: sampling.TrainBatchSampler = None, fingerprint: dict = None):
+    # lists of document indices (one list per batch) for each epoch
+    epoch_batches = []
+
+    for epoch in range(epochs):
+        if batch_sampler is not None:
+            batch_sampler.set_epoch(epoch)
+            epoch_batches.append(list(batch_sampler))
+        else:
+            order = list(range(dataset.document_count))
+            random.shuffle(order)
+            epoch_batches.append([order[i:i + batch_size] for i in range(0, len(order) - batch_size + 1, batch_size)])
+
+    # 'fingerprint': settings the shards depend on (dataset, batching, sampling), checked by 'read_plan'
+    return dict(epochs=epoch_batches, shard_size=shard_size, fingerprint=fingerprint)
+
+
+def produce(dataset: Dataset, shard_path: str, plan: dict):
+    """ Sample the training batches of all planned epochs and store them as shards (skipping existing shards) """
+    util.create_directories_dir(shard_path)
+    plan_file = os.path.join(shard_path, PLAN_FILE)
+
+    if not os.path.exists(plan_file):
+        _save(plan, plan_file)
+
+    shard_size = plan['shard_size']
+    for epoch, batches in enumerate(plan['epochs']):
+        for shard, start in enumerate(range(0, len(batches), shard_size)):
+            shard_file = os.path.join(shard_path, SHARD_FILE % (epoch, shard))
+
+            if not os.path.exists(shard_file):
+                # the random state is recorded to replay the sampling of a shard
+                _save(create_shard(dataset, batches[start:start + shard_size], random.getstate()), shard_file)
+
+
+def create_shard(dataset: Dataset, batches: list, rng_state: tuple):
+    # also used to replay a stored shard: create_shard(dataset, shard['batches'], shard['rng_state'])
+    random.setstate(rng_state)
+    dataset.switch_mode(Dataset.TRAIN_MODE)
+
+    samples = [sampling.collate_fn_padding([dataset[i] for i in indices], shared=False) for indices in batches]
+    return dict(rng_state=rng_state, batches=batches, samples=samples)
+
+
+def read_plan(shard_path: str, fingerprint: dict = None):
+    # existing shards are only reused if they were sampled with the same settings
+    plan_file = os.path.join(shard_path, PLAN_FILE)
+    if not os.path.exists(plan_file):
+        return None
+
+    plan = torch.load(plan_file)
+    plan_fingerprint = plan.get('fingerprint') or dict()
+    mismatches = sorted(key for key in set(plan_fingerprint) | set(fingerprint or dict())
+                        if plan_fingerprint.get(key) != (fingerprint or dict()).get(key))
+
+    if mismatches:
+        raise Exception("Shards in '%s' were sampled with different settings (%s)"
+                        % (shard_path, ', '.join(mismatches)))
+
+    return plan
+
+
+def iterate_epoch(shard_path: str, plan: dict, epoch: int, device, poll_interval: float = 1.0, producer=None):
+    # stream the batches of an epoch, waiting for shards that are not yet produced (by the 'producer' process)
+    shard_count = math.ceil(len(plan['epochs'][epoch]) / plan['shard_size'])
+
+    for shard in range(shard_count):
+        shard_file = _wait_for(os.path.join(shard_path, SHARD_FILE % (epoch, shard)), poll_interval, producer)
+
+        for batch in torch.load(shard_file)['samples']:
+            yield util.to_device(batch, device)
+
+
+def _wait_for(file_path, poll_interval, producer=None):
+    while not os.path.exists(file_path):
+        # the file may have been written just before the producer exited
+        if producer is not None and not producer.is_alive() and not os.path.exists(file_path):
+            raise Exception("Shard producer exited (exit code %s) without writing '%s'"
+                            % (producer.exitcode, file_path))
+
+        time.sleep(poll_interval)
+
+    return file_path
+
+
+def _save(obj, file_path):
+    # files only appear once written completely (read by other processes)
+    tmp_path = '%s.%s.tmp' % (file_path, os.getpid())
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, file_path)
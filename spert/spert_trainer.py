@@ -1,21 +1,23 @@
 import argparse
-import math
 import os
+import random
 
 import torch
+import torch.multiprocessing as mp
 from torch.nn import DataParallel
 from torch.optim import Optimizer
 import transformers
-from torch.utils.data import DataLoader
+from torch.utils.data import BatchSampler, RandomSampler, DataLoader
 from transformers import AdamW, BertConfig
 from transformers import BertTokenizer
 
 from spert import models
 from spert import sampling
+from spert import shards
 from spert import util
-from spert.entities import Dataset
+from spert.entities import Dataset, StreamingDataset
 from spert.evaluator import Evaluator
-from spert.input_reader import JsonInputReader, BaseInputReader
+from spert.input_reader import JsonInputReader, BaseInputReader, StreamingInputReader
 from spert.loss import SpERTLoss, Loss
 from tqdm import tqdm
 from spert.trainer import BaseTrainer
@@ -30,7 +32,14 @@ class SpERTTrainer(BaseTrainer):
         super().__init__(args)
 
         # byte-pair encoding
-        self._tokenizer = BertTokenizer.from_pretrained(args.tokenizer_path,
+        tokenizer_cls = BertTokenizer
+        if args.fast_tokenizer:
+            # fast (batched) tokenization of datasets, only available in newer versions of transformers
+            tokenizer_cls = getattr(transformers, 'BertTokenizerFast', None)
+            if tokenizer_cls is None:
+                raise Exception("Fast tokenizer not supported by installed version of transformers")
+
+        self._tokenizer = tokenizer_cls.from_pretrained(args.tokenizer_path,
                                                         do_lower_case=args.lowercase,
                                                         cache_dir=args.cache_path)
 
@@ -40,6 +49,10 @@ class SpERTTrainer(BaseTrainer):
         # path to export relation extraction examples to
         self._examples_path = os.path.join(self._log_path, 'examples_%s_%s_epoch_%s.html')
 
+        # sampling processes (created after reading datasets)
+        self._sampling_pool = None
+        self._shard_producer = None
+
     def train(self, train_path: str, valid_path: str, types_path: str, input_reader_cls: BaseInputReader):
         args = self.args
         train_label, valid_label = 'train', 'valid'
@@ -53,20 +66,84 @@ class SpERTTrainer(BaseTrainer):
 
         # read datasets
         input_reader = input_reader_cls(types_path, self._tokenizer, args.neg_entity_count,
-                                        args.neg_relation_count, args.max_span_size, self._logger)
-        input_reader.read({train_label: train_path, valid_label: valid_path})
-        self._log_datasets(input_reader)
-
-        train_dataset = input_reader.get_dataset(train_label)
+                                        args.neg_relation_count, args.max_span_size, self._logger,
+                                        args.dataset_cache_path, args.parse_processes)
+
+        if args.stream_train:
+            if args.train_batch_budget or args.shard_path:
+                raise Exception("Streamed training data does not support '--train_batch_budget' or '--shard_path'")
+
+            # training documents are parsed while iterating
+            input_reader.read({valid_label: valid_path})
+            train_reader = StreamingInputReader(types_path, self._tokenizer, args.neg_entity_count,
+                                                args.neg_relation_count, args.max_span_size, self._logger,
+                                                shuffle_buffer=args.shuffle_buffer)
+            train_reader.read({train_label: train_path})
+        else:
+            input_reader.read({train_label: train_path, valid_label: valid_path})
+            train_reader = input_reader
+
+        if args.derive_rel_signatures or args.span_size_percentile is not None:
+            if args.stream_train:
+                raise Exception("Streamed training data does not support '--derive_rel_signatures' "
+                                "or '--span_size_percentile'")
+
+            self._derive_types(input_reader, train_label)
+
+        if args.stream_train:
+            self._log_datasets(input_reader, train_reader)
+        else:
+            self._log_datasets(input_reader)
+
+        train_dataset = train_reader.get_dataset(train_label)
         train_sample_count = train_dataset.document_count
-        updates_epoch = train_sample_count // args.train_batch_size
-        updates_total = updates_epoch * args.epochs
+        train_dataset.set_train_cache_size(args.train_cache_size, args.sampling_processes)
+
+        max_rel_distance = self._max_rel_distance(input_reader, train_dataset)
+
+        if args.derive_rel_signatures or args.span_size_percentile is not None \
+                or args.rel_distance_percentile is not None:
+            # learned policies are used by later evaluation with these types
+            types_path = os.path.join(self._log_path, 'types.json')
+            input_reader.save_types(types_path)
+            self._logger.info("Types derived from training data: %s" % types_path)
+
+        if args.train_batch_budget:
+            # variable count of documents per batch
+            train_batch_sampler = sampling.TrainBatchSampler(train_dataset, args.train_batch_budget,
+                                                             train_reader.max_span_size, args.neg_entity_count,
+                                                             args.epochs)
+            updates_total = train_batch_sampler.batch_count
+        else:
+            train_batch_sampler = None
+            updates_total = (train_sample_count // args.train_batch_size) * args.epochs
+
+            if isinstance(train_dataset, StreamingDataset):
+                updates_total = train_dataset.batch_count(args.train_batch_size, args.sampling_processes) * args.epochs
+
+        if args.shard_path:
+            # stream pre-sampled batches (missing shards are produced by a background process)
+            fingerprint = self._shard_fingerprint(train_reader, train_dataset, train_path, max_rel_distance)
+            train_shard_plan = self._init_shards(train_dataset, train_batch_sampler, fingerprint)
+            updates_total = sum(len(batches) for batches in train_shard_plan['epochs'][:args.epochs])
+        else:
+            train_shard_plan = None
+
+        updates_epoch = updates_total // args.epochs
 
         validation_dataset = input_reader.get_dataset(valid_label)
+        validation_dataset.enable_eval_cache(args.eval_cache_size, args.eval_cache_path, args.sampling_processes)
 
         self._logger.info("Updates per epoch: %s" % updates_epoch)
         self._logger.info("Updates total: %s" % updates_total)
 
+        if updates_total > 0:
+            self._logger.info("Effective batch size: %.2f" % (train_sample_count * args.epochs / updates_total))
+
+        # fork sampling processes before the model is created
+        self._sampling_pool = sampling.SamplingPool(input_reader.datasets, args.sampling_processes,
+                                                    args.sampling_limit)
+
         # create model
         model_class = models.get_model(self.args.model_type)
 
@@ -86,7 +163,15 @@ class SpERTTrainer(BaseTrainer):
           prop_drop=self.args.prop_drop,
           size_embedding=self.args.size_embedding,
           freeze_transformer=self.args.freeze_transformer,
-          pre_train=self.args.pre_train
+          pre_train=self.args.pre_train,
+          window_size=self.args.window_size,
+          window_overlap=self.args.window_overlap,
+          window_batch_size=self.args.window_batch_size,
+          max_rel_entities=self.args.max_rel_entities,
+          min_rel_entity_score=self.args.min_rel_entity_score,
+          rel_signatures=input_reader.relation_signatures,
+          max_rel_distance=max_rel_distance,
+          entity_size_limits=input_reader.entity_size_limits
         )
 
         # SpERT is currently optimized on a single GPU and not thoroughly tested in a multi GPU setup
@@ -111,26 +196,70 @@ class SpERTTrainer(BaseTrainer):
 
         # eval validation set
         if args.init_eval:
-            self._eval(model, validation_dataset, input_reader, 0, updates_epoch)
+            self._eval(model, validation_dataset, input_reader, 0, 0)
 
         # train
+        global_iteration = 0
         for epoch in range(args.epochs):
             # train epoch
-            self._train_epoch(model, compute_loss, optimizer, train_dataset, updates_epoch, epoch)
+            global_iteration += self._train_epoch(model, compute_loss, optimizer, train_dataset,
+                                                  epoch, global_iteration, train_batch_sampler, train_shard_plan)
 
             # eval validation sets
             if not args.final_eval or (epoch == args.epochs - 1):
-                self._eval(model, validation_dataset, input_reader, epoch + 1, updates_epoch)
+                self._eval(model, validation_dataset, input_reader, epoch + 1, global_iteration)
 
         # save final model
         extra = dict(epoch=args.epochs, updates_epoch=updates_epoch, epoch_iteration=0)
-        global_iteration = args.epochs * updates_epoch
         self._save_model(self._save_path, model, self._tokenizer, global_iteration,
                          optimizer=optimizer if self.args.save_optimizer else None, extra=extra,
                          include_iteration=False, name='final_model')
 
         self._logger.info("Logged in: %s" % self._log_path)
         self._logger.info("Saved in: %s" % self._save_path)
+        self._sampling_pool.close()
+        self._close_summary_writer()
+
+        if self._shard_producer is not None:
+            self._shard_producer.join()
+
+    def sample(self, train_path: str, types_path: str, input_reader_cls: BaseInputReader):
+        args = self.args
+        train_label = 'train'
+
+        self._logger.info("Dataset: %s" % train_path)
+        self._logger.info("Shards: %s" % args.shard_path)
+
+        # read datasets
+        input_reader = input_reader_cls(types_path, self._tokenizer, args.neg_entity_count,
+                                        args.neg_relation_count, args.max_span_size, self._logger,
+                                        args.dataset_cache_path, args.parse_processes)
+        input_reader.read({train_label: train_path})
+
+        # samples are created as in training
+        self._derive_types(input_reader, train_label)
+
+        self._log_datasets(input_reader)
+
+        train_dataset = input_reader.get_dataset(train_label)
+        train_batch_sampler = None
+        max_rel_distance = self._max_rel_distance(input_reader, train_dataset)
+
+        if args.train_batch_budget:
+            train_batch_sampler = sampling.TrainBatchSampler(train_dataset, args.train_batch_budget,
+                                                             input_reader.max_span_size, args.neg_entity_count,
+                                                             args.epochs)
+
+        # sample (missing) shards of all epochs
+        fingerprint = self._shard_fingerprint(input_reader, train_dataset, train_path, max_rel_distance)
+        plan = shards.read_plan(args.shard_path, fingerprint)
+        if plan is None:
+            plan = shards.create_plan(train_dataset, args.epochs, args.train_batch_size, args.shard_size,
+                                      train_batch_sampler, fingerprint)
+
+        shards.produce(train_dataset, args.shard_path, plan)
+
+        self._logger.info("Logged in: %s" % self._log_path)
         self._close_summary_writer()
 
     def eval(self, dataset_path: str, types_path: str, input_reader_cls: BaseInputReader):
@@ -145,10 +274,18 @@ class SpERTTrainer(BaseTrainer):
 
         # read datasets
         input_reader = input_reader_cls(types_path, self._tokenizer,
-                                        max_span_size=args.max_span_size, logger=self._logger)
+                                        max_span_size=args.max_span_size, logger=self._logger,
+                                        cache_path=args.dataset_cache_path, parse_processes=args.parse_processes)
         input_reader.read({dataset_label: dataset_path})
         self._log_datasets(input_reader)
 
+        dataset = input_reader.get_dataset(dataset_label)
+        dataset.enable_eval_cache(args.eval_cache_size, args.eval_cache_path, args.sampling_processes)
+
+        # fork sampling processes before the model is created
+        self._sampling_pool = sampling.SamplingPool(input_reader.datasets, args.sampling_processes,
+                                                    args.sampling_limit)
+
         # create model
         model_class = models.get_model(self.args.model_type)
 
@@ -166,38 +303,65 @@ class SpERTTrainer(BaseTrainer):
           prop_drop=self.args.prop_drop,
           size_embedding=self.args.size_embedding,
           freeze_transformer=self.args.freeze_transformer,
-          pre_train=self.args.pre_train
+          pre_train=self.args.pre_train,
+          window_size=self.args.window_size,
+          window_overlap=self.args.window_overlap,
+          window_batch_size=self.args.window_batch_size,
+          max_rel_entities=self.args.max_rel_entities,
+          min_rel_entity_score=self.args.min_rel_entity_score,
+          rel_signatures=input_reader.relation_signatures,
+          max_rel_distance=self._default_max_rel_distance(input_reader),
+          entity_size_limits=input_reader.entity_size_limits
         )
 
         model.to(self._device)
 
         # evaluate
-        self._eval(model, input_reader.get_dataset(dataset_label), input_reader)
+        self._eval(model, dataset, input_reader)
 
         self._logger.info("Logged in: %s" % self._log_path)
+        self._sampling_pool.close()
         self._close_summary_writer()
 
     def _train_epoch(self, model: torch.nn.Module, compute_loss: Loss, optimizer: Optimizer, dataset: Dataset,
-                     updates_epoch: int, epoch: int):
+                     epoch: int, global_offset: int, batch_sampler: sampling.TrainBatchSampler = None,
+                     shard_plan: dict = None):
         self._logger.info("Train epoch: %s" % epoch)
 
-        # create data loader
-        dataset.switch_mode(Dataset.TRAIN_MODE)
-        data_loader = DataLoader(dataset, batch_size=self.args.train_batch_size, shuffle=True, drop_last=True,
-                                 num_workers=self.args.sampling_processes, collate_fn=sampling.collate_fn_padding)
+        if shard_plan is not None:
+            # pre-sampled batches
+            batches = shards.iterate_epoch(self.args.shard_path, shard_plan, epoch, self._device,
+                                           producer=self._shard_producer)
+            total = len(shard_plan['epochs'][epoch])
+        elif isinstance(dataset, StreamingDataset):
+            # documents are parsed and sampled by data loader workers
+            dataset.set_seed(random.getrandbits(32))
+            dataset.switch_mode(Dataset.TRAIN_MODE)
+            data_loader = DataLoader(dataset, batch_size=self.args.train_batch_size, drop_last=True,
+                                     num_workers=self.args.sampling_processes, collate_fn=sampling.collate_fn_padding)
+            batches = (util.to_device(batch, self._device) for batch in data_loader)
+            total = dataset.batch_count(self.args.train_batch_size, self.args.sampling_processes)
+        else:
+            # create batches
+            if batch_sampler is not None:
+                batch_sampler.set_epoch(epoch)
+            else:
+                batch_sampler = BatchSampler(RandomSampler(dataset), self.args.train_batch_size, drop_last=True)
+
+            # batches are sampled ahead and moved to the device in background
+            batches = self._sampling_pool.iterate(dataset, Dataset.TRAIN_MODE, batch_sampler, self._device)
+            total = len(batch_sampler)
 
         model.zero_grad()
 
         iteration = 0
-        total = dataset.document_count // self.args.train_batch_size
-        for batch in tqdm(data_loader, total=total, desc='Train epoch %s' % epoch):
+        for batch in tqdm(batches, total=total, desc='Train epoch %s' % epoch):
             model.train()
-            batch = util.to_device(batch, self._device)
 
             # forward step
             entity_logits, rel_logits = model(encodings=batch['encodings'], context_masks=batch['context_masks'],
-                                              entity_masks=batch['entity_masks'], entity_sizes=batch['entity_sizes'],
-                                              relations=batch['rels'], rel_masks=batch['rel_masks'])
+                                              entity_spans=batch['entity_spans'], entity_sizes=batch['entity_sizes'],
+                                              relations=batch['rels'], rel_ctx_spans=batch['rel_ctx_spans'])
 
             # compute loss and optimize parameters
             batch_loss = compute_loss.compute(entity_logits=entity_logits, rel_logits=rel_logits,
@@ -207,15 +371,16 @@ class SpERTTrainer(BaseTrainer):
 
             # logging
             iteration += 1
-            global_iteration = epoch * updates_epoch + iteration
+            global_iteration = global_offset + iteration
 
             if global_iteration % self.args.train_log_iter == 0:
-                self._log_train(optimizer, batch_loss, epoch, iteration, global_iteration, dataset.label)
+                self._log_train(optimizer, batch_loss, batch['encodings'].shape[0],
+                                epoch, iteration, global_iteration, dataset.label)
 
         return iteration
 
     def _eval(self, model: torch.nn.Module, dataset: Dataset, input_reader: JsonInputReader,
-              epoch: int = 0, updates_epoch: int = 0, iteration: int = 0):
+              epoch: int = 0, global_iteration: int = 0, iteration: int = 0):
         self._logger.info("Evaluate: %s" % dataset.label)
 
         if isinstance(model, DataParallel):
@@ -228,33 +393,32 @@ class SpERTTrainer(BaseTrainer):
                               self._examples_path, self.args.example_count, epoch, dataset.label)
 
         # create data loader
-        dataset.switch_mode(Dataset.EVAL_MODE)
-        data_loader = DataLoader(dataset, batch_size=self.args.eval_batch_size, shuffle=False, drop_last=False,
-                                 num_workers=self.args.sampling_processes, collate_fn=sampling.collate_fn_padding)
+        # documents are batched by length, the evaluator restores the original order
+        batch_sampler = sampling.EvalBatchSampler(dataset, self.args.eval_batch_size)
+        batches = self._sampling_pool.iterate(dataset, Dataset.EVAL_MODE, batch_sampler, self._device)
+
+        model.reset_pruning_counts()
 
         with torch.no_grad():
             model.eval()
 
             # iterate batches
-            total = math.ceil(dataset.document_count / self.args.eval_batch_size)
-            for batch in tqdm(data_loader, total=total, desc='Evaluate epoch %s' % epoch):
-                # move batch to selected device
-                batch = util.to_device(batch, self._device)
-
+            total = len(batch_sampler)
+            for batch, doc_indices in tqdm(zip(batches, batch_sampler), total=total,
+                                           desc='Evaluate epoch %s' % epoch):
                 # run model (forward pass)
                 result = model(encodings=batch['encodings'], context_masks=batch['context_masks'],
-                               entity_masks=batch['entity_masks'], entity_sizes=batch['entity_sizes'],
-                               entity_spans=batch['entity_spans'], entity_sample_masks=batch['entity_sample_masks'],
-                               evaluate=True)
+                               entity_spans=batch['entity_spans'], entity_sizes=batch['entity_sizes'],
+                               entity_sample_masks=batch['entity_sample_masks'], evaluate=True)
                 entity_clf, rel_clf, rels = result
 
                 # evaluate batch
-                evaluator.eval_batch(entity_clf, rel_clf, rels, batch)
+                evaluator.eval_batch(entity_clf, rel_clf, rels, batch, doc_indices)
 
-        global_iteration = epoch * updates_epoch + iteration
         ner_eval, rel_eval, rel_nec_eval = evaluator.compute_scores()
         self._log_eval(*ner_eval, *rel_eval, *rel_nec_eval,
                        epoch, iteration, global_iteration, dataset.label)
+        self._log_pruning(model.pruning_counts, global_iteration, dataset.label)
 
         if self.args.store_predictions and not self.args.no_overlapping:
             evaluator.store_predictions()
@@ -262,6 +426,75 @@ class SpERTTrainer(BaseTrainer):
         if self.args.store_examples:
             evaluator.store_examples()
 
+    def _derive_types(self, input_reader: BaseInputReader, train_label: str):
+        if self.args.derive_rel_signatures:
+            # possible relations are restricted to the entity types they hold in training data
+            input_reader.derive_relation_signatures(train_label)
+
+        if self.args.span_size_percentile is not None:
+            # candidate spans are restricted to the sizes of training entities (per entity type)
+            input_reader.derive_span_size_limits(train_label, self.args.span_size_percentile)
+
+    def _max_rel_distance(self, input_reader: BaseInputReader, train_dataset: Dataset):
+        args = self.args
+        max_rel_distance = self._default_max_rel_distance(input_reader)
+
+        if args.rel_distance_percentile is not None:
+            if args.stream_train:
+                raise Exception("Streamed training data does not support '--rel_distance_percentile'")
+
+            # limit learned from the distances of training relations
+            max_rel_distance = input_reader.relation_distance(train_dataset.label, args.rel_distance_percentile)
+            self._logger.info("Maximum relation distance (%s percentile of training relations): %s"
+                              % (args.rel_distance_percentile, max_rel_distance))
+            input_reader.set_max_rel_distance(max_rel_distance)
+
+        if max_rel_distance is not None:
+            # negative relations are sampled like relation candidates in evaluation
+            train_dataset.set_max_rel_distance(max_rel_distance)
+
+        return max_rel_distance
+
+    def _default_max_rel_distance(self, input_reader: BaseInputReader):
+        # explicitly set, otherwise from type specifications (e.g. learned in training, see 'save_types')
+        if self.args.max_rel_distance is not None:
+            return self.args.max_rel_distance
+
+        return input_reader.max_rel_distance
+
+    def _init_shards(self, dataset: Dataset, batch_sampler: sampling.TrainBatchSampler = None,
+                     fingerprint: dict = None):
+        args = self.args
+
+        # use the plan of existing shards (e.g. sampled ahead of time by 'spert.py sample')
+        plan = shards.read_plan(args.shard_path, fingerprint)
+        if plan is None:
+            plan = shards.create_plan(dataset, args.epochs, args.train_batch_size, args.shard_size, batch_sampler,
+                                      fingerprint)
+        elif len(plan['epochs']) < args.epochs:
+            raise Exception("Shards in '%s' only cover %s epochs" % (args.shard_path, len(plan['epochs'])))
+
+        # background process that samples missing shards ahead of training
+        self._shard_producer = mp.get_context('fork').Process(target=shards.produce,
+                                                              args=(dataset, args.shard_path, plan), daemon=True)
+        self._shard_producer.start()
+
+        return plan
+
+    def _shard_fingerprint(self, input_reader: BaseInputReader, train_dataset: Dataset, train_path: str,
+                           max_rel_distance: int):
+        # settings training samples depend on (shards of other settings are not reused)
+        args = self.args
+        signatures = input_reader.relation_signatures
+
+        return dict(dataset=input_reader.dataset_key(train_path),
+                    document_count=train_dataset.document_count,
+                    batch_size=None if args.train_batch_budget else args.train_batch_size,
+                    batch_budget=args.train_batch_budget, neg_entity_count=args.neg_entity_count,
+                    neg_relation_count=args.neg_relation_count, max_span_size=input_reader.max_span_size,
+                    rel_signatures=signatures.tolist() if signatures is not None else None,
+                    max_rel_distance=max_rel_distance)
+
     def _get_optimizer_params(self, model):
         param_optimizer = list(model.named_parameters())
         no_decay = ['bias', 'LayerNorm.bias', 'LayerNorm.weight']
@@ -272,10 +505,10 @@ class SpERTTrainer(BaseTrainer):
 
         return optimizer_params
 
-    def _log_train(self, optimizer: Optimizer, loss: float, epoch: int,
+    def _log_train(self, optimizer: Optimizer, loss: float, batch_size: int, epoch: int,
                    iteration: int, global_iteration: int, label: str):
         # average loss
-        avg_loss = loss / self.args.train_batch_size
+        avg_loss = loss / batch_size
         # get current learning rate
         lr = self._get_lr(optimizer)[0]
 
@@ -332,7 +565,22 @@ class SpERTTrainer(BaseTrainer):
                       rel_nec_prec_macro, rel_nec_rec_macro, rel_nec_f1_macro,
                       epoch, iteration, global_iteration)
 
-    def _log_datasets(self, input_reader):
+    def _log_pruning(self, pruning_counts: dict, global_iteration: int, label: str):
+        # relation candidates pruned in evaluation (e.g. by the entity budget)
+        self._logger.info("Pruned entities for relations: %s of %s" % (pruning_counts['pruned_entities'],
+                                                                       pruning_counts['entities']))
+        self._logger.info("Pruned relation pairs: %s of %s" % (pruning_counts['pruned_pairs'],
+                                                               pruning_counts['pairs']))
+        self._logger.info("Relation pairs filtered by type: %s" % pruning_counts['type_filtered_pairs'])
+        self._logger.info("Relation pairs filtered by distance: %s" % pruning_counts['distance_filtered_pairs'])
+
+        for key, value in pruning_counts.items():
+            self._log_tensorboard(label, 'eval/%s' % key, value, global_iteration)
+
+    def _log_datasets(self, input_reader, *other_readers):
+        # other readers (e.g. of streamed training data) share the types of 'input_reader'
+        readers = (input_reader,) + other_readers
+
         self._logger.info("Relation type count: %s" % input_reader.relation_type_count)
         self._logger.info("Entity type count: %s" % input_reader.entity_type_count)
 
@@ -340,17 +588,26 @@ class SpERTTrainer(BaseTrainer):
         for e in input_reader.entity_types.values():
             self._logger.info(e.verbose_name + '=' + str(e.index))
 
+            if e.max_span_size is not None:
+                self._logger.info('  max span size: %s' % e.max_span_size)
+
         self._logger.info("Relations:")
         for r in input_reader.relation_types.values():
             self._logger.info(r.verbose_name + '=' + str(r.index))
 
-        for k, d in input_reader.datasets.items():
-            self._logger.info('Dataset: %s' % k)
-            self._logger.info("Document count: %s" % d.document_count)
-            self._logger.info("Relation count: %s" % d.relation_count)
-            self._logger.info("Entity count: %s" % d.entity_count)
+            if r.signatures is not None:
+                self._logger.info('  ' + ', '.join('%s -> %s' % (h.verbose_name, t.verbose_name)
+                                                   for h, t in r.signatures))
+
+        for reader in readers:
+            for k, d in reader.datasets.items():
+                self._logger.info('Dataset: %s' % k)
+                self._logger.info("Document count: %s" % d.document_count)
+                self._logger.info("Relation count: %s" % d.relation_count)
+                self._logger.info("Entity count: %s" % d.entity_count)
 
-        self._logger.info("Context size: %s" % input_reader.context_size)
+        self._logger.info("Context size: %s" % max(reader.context_size for reader in readers))
+        self._logger.info("Max span size: %s" % input_reader.max_span_size)
 
     def _init_train_logging(self, label):
         self._add_dataset_logging(label,
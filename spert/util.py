@@ -134,46 +134,141 @@ def get_as_list(dic, key):
         return []
 
 
-def extend_tensor(tensor, extended_shape, fill=0):
-    tensor_shape = tensor.shape
-
-    extended_tensor = torch.zeros(extended_shape, dtype=tensor.dtype).to(tensor.device)
-    extended_tensor = extended_tensor.fill_(fill)
-
-    if len(tensor_shape) == 1:
-        extended_tensor[:tensor_shape[0]] = tensor
-    elif len(tensor_shape) == 2:
-        extended_tensor[:tensor_shape[0], :tensor_shape[1]] = tensor
-    elif len(tensor_shape) == 3:
-        extended_tensor[:tensor_shape[0], :tensor_shape[1], :tensor_shape[2]] = tensor
-    elif len(tensor_shape) == 4:
-        extended_tensor[:tensor_shape[0], :tensor_shape[1], :tensor_shape[2], :tensor_shape[3]] = tensor
-
-    return extended_tensor
+def padded_stack(tensors, padding=0, shared=False):
+    # stack tensors of different shapes into a single (once allocated) tensor padded to the maximum shape
+    # 'shared': allocate in shared memory (e.g. to pass batches from sampling processes without copying)
+    dim_count = len(tensors[0].shape)
+    max_shape = [max([t.shape[d] for t in tensors]) for d in range(dim_count)]
 
+    shape = [len(tensors)] + max_shape
 
-def padded_stack(tensors, padding=0):
-    dim_count = len(tensors[0].shape)
+    if shared:
+        # storage is created in shared memory directly (as by the default collate function of torch's data loader)
+        storage = tensors[0].storage()._new_shared(int(np.prod(shape)))
+        stacked = tensors[0].new(storage).view(shape)
+    else:
+        stacked = torch.empty(shape, dtype=tensors[0].dtype, device=tensors[0].device)
 
-    max_shape = [max([t.shape[d] for t in tensors]) for d in range(dim_count)]
-    padded_tensors = []
+    stacked.fill_(padding)
 
-    for t in tensors:
-        e = extend_tensor(t, max_shape, fill=padding)
-        padded_tensors.append(e)
+    for i, t in enumerate(tensors):
+        stacked[i][tuple(slice(0, d) for d in t.shape)] = t
 
-    stacked = torch.stack(padded_tensors)
     return stacked
 
 
-def batch_index(tensor, index, pad=False):
+def batch_index(tensor, index):
+    # index each batch row of 'tensor' with the corresponding row of 'index' (in a single indexing operation)
     if tensor.shape[0] != index.shape[0]:
         raise Exception()
 
-    if not pad:
-        return torch.stack([tensor[i][index[i]] for i in range(index.shape[0])])
-    else:
-        return padded_stack([tensor[i][index[i]] for i in range(index.shape[0])])
+    batch_indices = torch.arange(index.shape[0], device=index.device).view([-1] + [1] * (index.dim() - 1))
+    return tensor[batch_indices, index]
+
+
+def span_masks(spans, context_size):
+    # expand (start, end) index pairs of shape [..., 2] into boolean masks of shape [..., context_size]
+    positions = torch.arange(context_size, device=spans.device)
+    return (positions >= spans[..., 0:1]) & (positions < spans[..., 1:2])
+
+
+class SpanMaxPool(torch.autograd.Function):
+    """ Masked max pooling of spans that only keeps the argmax token indices for backward """
+
+    @staticmethod
+    def forward(ctx, h, spans, chunk_size):
+        pool, indices = [], []
+
+        # masked max pooling (as in evaluation without gradients), chunked to bound the [B, N, T, H] tensor
+        for i in range(0, max(spans.shape[1], 1), chunk_size):
+            m = (span_masks(spans[:, i:i + chunk_size], h.shape[1]).unsqueeze(-1) == 0).float() * (-1e30)
+            chunk_pool, chunk_indices = (m + h.unsqueeze(1)).max(dim=2)
+            pool.append(chunk_pool)
+            indices.append(chunk_indices)
+
+        ctx.save_for_backward(torch.cat(indices, dim=1))
+        ctx.context_size = h.shape[1]
+
+        return torch.cat(pool, dim=1)
+
+    @staticmethod
+    def backward(ctx, grad_pool):
+        indices, = ctx.saved_tensors
+
+        # scatter gradients into the argmax tokens
+        grad_h = grad_pool.new_zeros([grad_pool.shape[0], ctx.context_size, grad_pool.shape[2]])
+        grad_h.scatter_add_(1, indices, grad_pool)
+
+        return grad_h, None, None
+
+
+def span_max_pool(h, spans, chunk_elements=1 << 24):
+    # max pool spans (start, end) [B, N, 2] of h [B, T, H], empty spans are -1e30
+    chunk_size = max(1, chunk_elements // (h.shape[0] * h.shape[1] * h.shape[2]))
+    return SpanMaxPool.apply(h, spans, chunk_size)
+
+
+def max_pool_spans(h, spans, batch_indices=None):
+    # max pool spans (start, end) [B, N, 2] (or packed [M, 2] of documents 'batch_indices') of h [B, T, H]
+    # without a [B, N, T, H] tensor: pool(i, k), the maximum of tokens i..i+k-1, is computed incrementally
+    # by pool(i, k) = max(pool(i, k - 1), h[i + k - 1])
+    starts, sizes = spans[..., 0], spans[..., 1] - spans[..., 0]
+    if batch_indices is None:
+        batch_indices = _batch_indices(starts)
+
+    # empty (padding) spans equal masked max pooling over all tokens
+    pool = h.new_full(list(starts.shape) + [h.shape[-1]], -1e30)
+    pool_k = h
+
+    for k in range(1, int(sizes.max()) + 1 if sizes.numel() else 1):
+        if k > 1:
+            pool_k = torch.max(pool_k[:, :-1], h[:, k - 1:])
+
+        selected = sizes == k
+        pool[selected] = pool_k[batch_indices[selected], starts[selected]]
+
+    return pool
+
+
+def range_max_table(h):
+    # sparse table of h [B, T, H]: table[j, :, i] is the maximum of tokens i..i + 2^j - 1, shape [log T + 1, B, T, H]
+    context_size = h.shape[1]
+    levels = context_size.bit_length()
+
+    table = h.new_empty([levels] + list(h.shape))
+    table[0] = h
+
+    for j in range(1, levels):
+        half, count = 1 << (j - 1), context_size - (1 << j) + 1
+        table[j, :, :count] = torch.max(table[j - 1, :, :count], table[j - 1, :, half:half + count])
+
+    return table
+
+
+def range_max(table, spans, batch_indices=None):
+    # maximum of spans (start, end) [B, P, 2] (or packed [Q, 2] of documents 'batch_indices') by two
+    # overlapping table entries, empty spans are set to zero
+    empty = spans[..., 1] <= spans[..., 0]
+    starts = spans[..., 0].masked_fill(empty, 0)
+    ends = spans[..., 1].masked_fill(empty, 1)
+    sizes = ends - starts
+
+    # level: floor(log2(size)), corrected for floating point rounding
+    levels = torch.floor(torch.log2(sizes.float())).long()
+    levels = levels + ((1 << (levels + 1)) <= sizes).long() - ((1 << levels) > sizes).long()
+
+    if batch_indices is None:
+        batch_indices = _batch_indices(starts)
+
+    pool = torch.max(table[levels, batch_indices, starts], table[levels, batch_indices, ends - (1 << levels)])
+    pool[empty] = 0
+
+    return pool
+
+
+def _batch_indices(index):
+    # batch (first dimension) index of each entry of 'index'
+    return torch.arange(index.shape[0], device=index.device).view([-1] + [1] * (index.dim() - 1)).expand_as(index)
 
 
 def padded_nonzero(tensor, padding=0):